@@ -1,241 +1,525 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Blueprint, Flask, render_template, request, redirect, url_for, jsonify, g, Response, make_response
 import pandas as pd
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta, timezone
 import random
-from concurrent.futures import ThreadPoolExecutor
 import time
 import threading
-from datetime import datetime
-from data_maintenance import archive_data
+import hashlib
+import math
+import re
+import functools
+from werkzeug.http import is_resource_modified
+from data_maintenance import maintenance, repository
+from reading_store import SECONDS_PER_DAY, ReadingStore, to_epoch, today_start_epoch
+from ingest import IngestQueue
+from charts import ChartCache, ChartError, ChartRenderer
+from intraday import IntradayIndex
+from reading_dedup import ReadingDedup, IdempotencyCache, NEW, DUPLICATE
+from group_usage import GROUP_DIMENSIONS
+from user_import import DWELLING_TYPES, REGIONS, METER_ID_PATTERN, METER_ID_MESSAGE, read_users, import_users, \
+    results as import_results
+from export import ExportError, parse_filters as parse_export_filters, encode as encode_export, \
+    filename as export_filename
+from request_log import RequestLogger, parse_sample_rates
+from metrics import Metrics
 import os
-import logging
+import json
+import atexit
+import config
 
 
-
-app = Flask(__name__)
+# 所有路由都注册在蓝图上，由 create_app() 创建应用。
+# 导入本模块不加载数据、不启动线程：create_app() 加载数据，start_background() 在开始服务时启动后台线程
+bp = Blueprint("main", __name__)
 
 
 # ---------------logs----------------
-# 配置日志
-logging.basicConfig(
-    filename='server.log',  # 日志文件
-    level=logging.INFO,  # 日志级别
-    format='%(asctime)s - %(levelname)s - %(message)s'  # 日志格式
+# 请求线程只把日志记录放进队列，由后台线程以 JSON 行写入 server.log（按大小/时间轮转）
+request_logger = RequestLogger(
+    config.LOG_FILE,
+    rotate=config.LOG_ROTATE,
+    max_bytes=config.LOG_MAX_BYTES,
+    backup_count=config.LOG_BACKUP_COUNT,
+    when=config.LOG_ROTATE_WHEN,
+    queue_size=config.LOG_QUEUE_SIZE,
+    sample_rates=parse_sample_rates(config.LOG_SAMPLE),
+    body_fields=config.LOG_BODY_FIELDS,
 )
 
-# 记录每个请求的信息
-@app.before_request
-def log_request_info():
-    log_data = {
-        "IP": request.remote_addr,
-        "Method": request.method,
-        "Path": request.path,
-        "Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "Args": request.args.to_dict(),
-        "Data": request.get_json() if request.is_json else request.form.to_dict()
-    }
-    logging.info(f"Request: {log_data}")
+# 每个路由的请求数、错误数和延迟分位数，在 /metrics 以 Prometheus 文本格式输出
+metrics = Metrics()
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# 记录每个请求的信息和耗时（在响应之后记录，请求体用视图函数已解析并缓存的结果，不再重复解析）
+@bp.after_app_request
+def log_request_info(response):
+    seconds = time.perf_counter() - g.get("request_started", time.perf_counter())
+    # 指标按视图函数名统计（去掉蓝图前缀 main.）
+    route = request.endpoint.rpartition(".")[2] if request.endpoint else "unmatched"
+    metrics.observe(route, seconds, response.status_code)
+
+    body = None
+    if request.is_json:
+        body = request.get_json(silent=True)
+    elif request.method == 'POST':
+        body = request.form
+    request_logger.log_request(
+        request.remote_addr, request.method, request.path, response.status_code, seconds,
+        args=request.args.to_dict(),
+        body=body,
+    )
+    return response
 
 # ---------------logs----------------
 
 
 
-# Sample data to simulate database
-users = [
-    {
-        "username": "John Doe",
-        "meter_id": "123-456-789",
-        "dwelling_type": "Apartment",
-        "region": "Central",
-        "area": "Downtown",
-        "community": "Greenfield",
-        "unit": "A1",
-        "floor": "5",
-        "email": "john@example.com",
-        "tel": "123-456-7890",
-        "reading": 0  # Initial reading value
-    }
-]
+# 注册表单的选项，也用于批量导入的校验（见 user_import.py）
+dwelling_types = DWELLING_TYPES
 
-dwelling_types = [
-    "1-room / 2-room", 
-    "3-room", 
-    "4-room", 
-    "5-room and Executive", 
-    "Landed Properties", 
-    "Private Apartments and Condominiums"
-]
+regions = REGIONS
 
-regions = ["Central", "East", "West", "North","South"]
+READING_FIELDS = ("meter_id", "time", "reading")
+MAINTENANCE_MESSAGE = "System maintenance in progress. Please try again after 1am."
 
-METER_CSV_PATH = 'meter_id.csv'
-LOCAL_DB_FILE = "local_db.csv"
+# intraday、reading_dedup 等内存结构只保存最近的读数，readings_after() 取回之后新增的读数（包括其他 worker 写入的）
+# readings 为已同步到的读数 id，load_state() 之前为 None
+synced = {"readings": None}
 
-#初始化临时dataframe
+# 每个电表今天的读数（按时间排序），由写线程在写入时维护
+intraday = IntradayIndex()
 
-data_columns = ["meter_id", "time", "reading"]
-data_store = pd.DataFrame(columns=data_columns)
+# 每个电表的数据版本号（最新读数的 id）和最后更新时间，用作图表缓存 key 和 API 的 ETag / Last-Modified
+meter_versions = {}
+meter_updated_at = {}
 
-#读取本地database为dataframe
-local_db = pd.read_csv('local_db.csv')
+# 最近几天的 (meter_id, time)：集中器超时重发的相同读数直接忽略，同一时间不同读数的拒绝（见 reading_dedup.py）
+reading_dedup = ReadingDedup(days=config.DEDUP_DAYS)
+# Idempotency-Key -> 第一次的响应
+idempotency_cache = IdempotencyCache(max_entries=config.IDEMPOTENCY_CACHE_ENTRIES,
+                                     max_bytes=config.IDEMPOTENCY_CACHE_BYTES)
 
+# 图表缓存（LRU）和渲染进程池
+chart_cache = ChartCache(max_entries=config.CHART_CACHE_ENTRIES, max_bytes=config.CHART_CACHE_BYTES)
+chart_renderer = ChartRenderer(workers=config.CHART_WORKERS, timeout=config.CHART_TIMEOUT)
+
+
+def bump_data_versions(meter_ids, version):
+    """
+    这些电表有了新数据：版本号设为这批数据最后一条读数的 id，并丢弃它们已缓存的图表。
+    """
+    updated_at = time.time()
+    for meter_id in meter_ids:
+        meter_versions[meter_id] = version
+        meter_updated_at[meter_id] = updated_at
+    chart_cache.invalidate(meter_ids)
 
 
 def save_meter_id_to_csv(meter_id, reading):
     """
-    这是一个将新用户meter_id以dataframe形式储存到memory中，并同时将日期保存为当天0点，电表读数初始化为0.
-    随其他meterreading记录存储时保存在本地。
+    这是一个将新用户meter_id的初始读数（日期为当天0点，读数为0）交给写入队列，
+    和其他meterreading记录一样由写线程写入 local_db.csv 和内存结构。
+    """
+    timestamp = to_epoch(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+    new_row = pd.DataFrame({"meter_id": [meter_id], "time": [timestamp], "reading": [float(reading)]})
+    # 注册很少发生，队列满时等待而不是拒绝
+    if not executor.submit(new_row, block=True, timeout=30):
+        print(f"Error saving meter_id: ingest queue is full, dropped initial reading of {meter_id}")
+
+
+def apply_readings(meter_ids, times, readings, version):
+    """
+    把一批读数加入内存结构：intraday、重复检查和版本号。
     """
-    global data_store
+    intraday.add(meter_ids, times, readings)
+    reading_dedup.add(meter_ids, times, readings)   # 包括其他 worker 写入的读数
+    bump_data_versions(pd.unique(meter_ids), version)
+
+
+def store_data_in_df(data):
+    """
+    写线程用来处理数据存储（只有这一个线程会写入读数）。将新输入的meterreading写入存储
+    （local_db.csv 或 SQLite，并同步更新用户的 reading），再同步到内存结构。
+    data 的 time 列已经是 int64 epoch 秒（在请求里解析一次），这里不再解析。
+    """
+    print(f"Storing {len(data)} new meter readings")
+    meter_ids, times, readings = data["meter_id"].to_numpy(), data["time"].to_numpy(dtype=np.int64), data["reading"].to_numpy()
     try:
-        timestamp = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
+        previous = repository.append_readings(meter_ids, times, readings)
+    except Exception:
+        # 没有写入：请求里 check_and_add 已把这些读数记为见过，要忘掉，否则客户端重发会被当作重复而永远不保存
+        reading_dedup.rollback(meter_ids, times)
+        raise
+    skipped = ~np.isnan(previous)
+    if skipped.any():
+        # 另一个 worker 已经写入了同一电表同一时间的读数（sqlite 的 UNIQUE 索引），这些行没有再写入
+        conflicts = skipped & (previous != readings)
+        reading_dedup.record(int(skipped.sum() - conflicts.sum()), int(conflicts.sum()))
+        print(f"Skipped {int(skipped.sum())} readings already stored by another worker ({int(conflicts.sum())} conflicts)")
+        for i in np.flatnonzero(conflicts):
+            print(f"  conflict: {conflict_message(meter_ids[i], int(times[i]), previous[i])} (got {readings[i]:g})")
+    sync_readings()
+    print("Data stored successfully!")
 
-        # Check if the CSV file exists
-        #try:
-            #meter_df = pd.read_csv('local_db.csv', dtype=str)  # Ensure all data is read as strings
-        #except FileNotFoundError:
-            # If file doesn't exist, create a new one with headers
-            #meter_df = pd.DataFrame(columns=["meter_id", "time", "reading"], dtype=str)
 
-        # Append the new meter_id, timestamp, and reading to the DataFrame
-        new_row = pd.DataFrame({"meter_id": [meter_id], "time": [timestamp], "reading": [str(reading)]}, dtype=str)
-        
-        data_store = pd.concat([data_store, new_row], ignore_index=True)
-        print(new_row)
+sync_lock = threading.Lock()
 
-        # Save DataFrame to CSV file as text (all columns are treated as strings)
-        #meter_df.to_csv('meter_id.csv', index=False, header=True, encoding='utf-8')
-    except Exception as e:
-        print(f"Error saving meter_id: {e}")
 
-#创建线程池
-executor = ThreadPoolExecutor(max_workers=10)
+def sync_readings():
+    """
+    把存储里新增的读数追加到本进程的内存结构。读数的 id 只增不减，没有新数据时只是一次主键查询。
+    用最新的读数 id 作版本号（而不是进程内的计数器）：各个 worker 进程、以及重启前后，
+    同样的数据给出同样的 ETag，不同的数据一定是不同的 ETag。
+    """
+    with sync_lock:
+        meter_ids, times, readings, last_id = repository.readings_after(synced["readings"])
+        if len(times):
+            apply_readings(meter_ids, times, readings, version=last_id)
+            synced["readings"] = last_id
 
-def store_data_in_df(data):
-    """后台线程用来处理数据存储。将新输入的meterreading保存到临时dataframe中，并同步更新users的reading"""
-    global data_store, users
-    
-    print("Storing new meter reading:", data)
-    time.sleep(1)
 
-    # 追加数据到 data_store
-    data_store = pd.concat([data_store, data], ignore_index=True)
+@bp.before_app_request
+def sync_before_request():
+    # 其他 worker 进程刚写入的读数在处理本请求前就能看到
+    if repository.shared:
+        sync_readings()
 
-    if os.path.exists('local_db.csv'):
-        # Read existing CSV file
-        d = pd.read_csv('local_db.csv')
-        # Append new data
-        data_new = pd.concat([d, data_store], ignore_index=True)
-    else:
-        # Create new DataFrame if file doesn't exist
-        data_new =data_store
 
-    
-    # 更新 users 里的 reading 值
-    for index, row in data_store.iterrows():
-        meter_id = row["meter_id"]
-        new_reading = row["reading"]
+def apply_ingest_batch(frames):
+    """写线程每次取出队列里已有的若干批读数，合并成一个 micro-batch 处理。"""
+    data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    store_data_in_df(data)
 
-        # **正确写法：用 loc 直接更新 DataFrame**
-        users.loc[users["meter_id"] == meter_id, "reading"] = new_reading
-        print(f"Updated {meter_id} reading in users: {new_reading}")
 
-    
-    
-    # **同步保存到 CSV**
-    save_users_to_csv()
+# 单一写线程 + 有界队列（代替原来的 10 线程线程池）
+executor = IngestQueue(apply_ingest_batch, maxsize=config.INGEST_QUEUE_SIZE, max_batch=config.INGEST_MAX_BATCH)
 
 
-    print("Data stored successfully!")
+def queue_full_response():
+    """队列已满：让客户端稍后重试。"""
+    response = jsonify({"status": "error", "message": "Server is busy, please retry later."})
+    response.headers["Retry-After"] = str(config.INGEST_RETRY_AFTER)
+    return response, 503
+
 
+metrics.gauge("ingest_queue_depth", "Reading batches waiting for the writer thread.", executor.qsize)
+metrics.gauge("ingest_queue_capacity", "Maximum number of queued reading batches.", lambda: executor.maxsize)
+metrics.gauge("intraday_meters", "Meters with readings today (held in memory).", lambda: len(intraday))
+metrics.counter("reading_duplicates_absorbed", "Retried readings that were already stored (not stored again).",
+                lambda: reading_dedup.duplicates)
+metrics.counter("reading_conflicts", "Readings rejected because the same meter and time has a different reading.",
+                lambda: reading_dedup.conflicts)
+metrics.gauge("reading_dedup_bytes", "Memory used by the duplicate check of recent readings.",
+              lambda: reading_dedup.nbytes)
+metrics.counter("idempotent_replays", "Requests answered from the Idempotency-Key cache.",
+                lambda: idempotency_cache.replays)
+metrics.gauge("idempotency_cache_bytes", "Size of the cached Idempotency-Key responses.",
+              lambda: idempotency_cache.nbytes)
+metrics.gauge("chart_cache_bytes", "Size of the cached usage charts.", lambda: chart_cache.nbytes)
+metrics.gauge("archive_last_duration_seconds", "Duration of the last archive_data() run.",
+              lambda: maintenance.last_duration)
+metrics.counter("log_records_dropped", "Request log records dropped because the log queue was full.",
+                lambda: request_logger.dropped)
 
-# **后台线程：每天 00:00 - 00:59 自动存储数据**
-def scheduled_task():
-    while True:
-        current_time = datetime.now()
-        if current_time.hour == 0:  # 00:00 触发
-            print(f"Running data maintenance at {current_time}")
-            archive_data()  # 数据归档
-            time.sleep(60)  # 避免多次触发，暂停 1 分钟
-        time.sleep(600)  # 每 10 分钟检查一次
 
-# 启动后台线程
-maintenance_thread = threading.Thread(target=scheduled_task, daemon=True)
-maintenance_thread.start()
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-@app.route('/')
+
+@bp.route('/maintenance/run', methods=['POST'])
+def run_maintenance():
+    """手动触发一次数据归档（在后台维护线程里执行）。"""
+    maintenance.trigger()
+    return jsonify({"status": "accepted", "message": "Data maintenance triggered."}), 202
+
+
+@bp.route('/')
 def index():
     """Main Page"""
     return render_template('index.html')
 
 
-@app.route('/meterreading', methods=['GET','POST'])
+def idempotent(view):
+    """
+    Idempotency-Key 请求头：同一个 key 再次请求时直接返回第一次的响应（只缓存成功的响应，
+    503 等失败的请求重试时会重新处理）。同一个 key 用于不同的请求体时返回 422。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if request.method != 'POST' or not key:
+            return view(*args, **kwargs)
+        cache_key = (request.path, key)
+        fingerprint = hashlib.sha1(request.get_data()).hexdigest()
+        cached = idempotency_cache.lookup(cache_key, fingerprint)
+        if cached is False:
+            return jsonify({"status": "error",
+                            "message": "Idempotency-Key was already used for a different request."}), 422
+        if cached is not None:
+            response = Response(cached[1], status=cached[0], mimetype="application/json")
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+        response = make_response(view(*args, **kwargs))
+        if 200 <= response.status_code < 300:
+            idempotency_cache.put(cache_key, fingerprint, response.status_code, response.get_data())
+        return response
+    return wrapper
+
+
+def conflict_message(meter_id, epoch, previous):
+    return (f"Conflicting reading: {meter_id} at {datetime.fromtimestamp(epoch, timezone.utc):%Y-%m-%d %H:%M:%S} "
+            f"was already saved with reading {previous}.")
+
+
+@bp.route('/meterreading', methods=['GET','POST'])
+@idempotent
 def meter_reading():
-    
-    global data_store
 
     if request.method == 'GET':
         return render_template('meter_reading.html')
     
     elif request.method == 'POST':
 
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"status": "error", "message": "Body must be a JSON object."}), 400
         if not all(k in data for k in ("meter_id", "time", "reading")):
             return jsonify({"status": "error", "message": "Please fill out all blanks."}), 400
 
-        meter_id = data["meter_id"]
+        # 和批量上传一样规范成去掉空白的字符串：JSON 数字 555 和 "555" 是同一个电表
+        meter_id = str(data["meter_id"]).strip()
         time = data["time"]
         reading = data["reading"]
 
-        #check meterID是否存在于users
-        if meter_id not in users["meter_id"].values:
+        #check meterID是否存在于users（索引查找，O(1)）
+        if not repository.has_user(meter_id):
             return jsonify({"status": "error", "message": "You are not registered. Please register first."}), 403
 
         
         #check 时间是否在12点到1点
-        time_obj = datetime.strptime(time, "%Y-%m-%dT%H:%M") 
-        formatted_time = time_obj.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            time_obj = datetime.strptime(time, "%Y-%m-%dT%H:%M")
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "Invalid time format, expected YYYY-MM-DDTHH:MM."}), 400
 
         if time_obj.hour == 0 and time_obj.minute > 0:
-            return jsonify({"status": "error", "message": "System maintenance in progress. Please try again after 1am."}), 403
+            return jsonify({"status": "error", "message": MAINTENANCE_MESSAGE}), 403
         elif time_obj.hour == 1 and time_obj.minute == 0:
-            return jsonify({"status": "error", "message": "System maintenance in progress. Please try again after 1am."}), 403
+            return jsonify({"status": "error", "message": MAINTENANCE_MESSAGE}), 403
 
         
-        # 追加数据到 `data_store`，然后同步更新 `users`
-        new_data = pd.DataFrame([{"meter_id": meter_id, "time": formatted_time, "reading": reading}])
+        # 交给写入队列，由写线程写入存储并同步更新 `users`
+        reading = parse_reading(reading)
+        if reading is None:
+            return jsonify({"status": "error", "message": "Reading must be a number."}), 400
+        epoch = to_epoch(time_obj)
+
+        # 重发的相同读数：已经保存过，直接返回成功；同一时间的不同读数：拒绝
+        status, previous = reading_dedup.check_and_add([meter_id], [epoch], [reading])
+        if status[0] == DUPLICATE:
+            return jsonify({"status": "success", "duplicate": True,
+                            "message": f"Reading already saved: {meter_id}, {time_obj:%Y-%m-%d %H:%M:%S}, {reading}"}), 200
+        if status[0] != NEW:
+            print(f"Conflicting reading for {meter_id} at {time_obj}: {reading} (saved: {previous[0]})")
+            return jsonify({"status": "error", "message": conflict_message(meter_id, epoch, previous[0])}), 409
+        new_data = pd.DataFrame({"meter_id": [meter_id], "time": [epoch], "reading": [reading]})
+
+        # 交给写线程存储数据并同步 `users` 里的 `reading`
+        if not executor.submit(new_data):
+            reading_dedup.rollback([meter_id], [epoch])   # 没有保存，客户端重试时要当作新读数
+            return queue_full_response()
 
-        # 启动线程存储数据并 **同步 `users` 里的 `reading`
-        executor.submit(store_data_in_df, new_data)
-
-        # `users` 里同步 `reading` 更新
-        users.loc[users["meter_id"] == str(meter_id), "reading"] = reading  
-        print(f"Updated {meter_id} reading in users: {reading}")  # 调试信息
+        # 让用户知道 `reading` 已被正确存储
+        return jsonify({"status": "success", "message": f"New reading saved: {meter_id}, {time_obj:%Y-%m-%d %H:%M:%S}, {reading}"}), 201
 
 
-        # 让用户知道 `reading` 已被正确存储
-        return jsonify({"status": "success", "message": f"New reading saved: {meter_id}, {formatted_time}, {reading}"}), 201
 
-import matplotlib.pyplot as plt
-import io
-import base64
-from flask import Flask, render_template, request, jsonify
-import pandas as pd
-from datetime import datetime, timedelta
+def parse_reading(value):
+    """读数转成 float；true/false、nan、inf 和溢出的数（如 1e400）返回 None。"""
+    if isinstance(value, bool):
+        return None
+    try:
+        reading = float(value)
+    except (TypeError, ValueError):
+        return None
+    return reading if math.isfinite(reading) else None
+
+
+def parse_batch_body():
+    """读取批量上传的数据：JSON 数组，或 NDJSON（每行一个 JSON 对象）。"""
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        lines = request.get_data(as_text=True).splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+    # silent=True：格式错误或不是 JSON 时返回 None，由下面给出 JSON 格式的 400，而不是 werkzeug 的 HTML 错误页
+    records = request.get_json(silent=True)
+    if isinstance(records, dict):
+        records = records.get("readings")
+    if not isinstance(records, list):
+        raise ValueError("Body must be a JSON array of readings.")
+    return records
+
+
+def validate_readings(records):
+    """
+    一次性（向量化）校验一批读数：字段是否齐全、时间格式、维护时段、读数是否为数字、电表是否已注册。
+    返回 (accepted, messages)：accepted 为通过校验的行（DataFrame），messages[i] 为第 i 条的错误信息或 None。
+    """
+    df = pd.DataFrame([r if isinstance(r, dict) else {} for r in records],
+                      columns=list(READING_FIELDS))
+
+    missing = df[list(READING_FIELDS)].isna().any(axis=1)
+    meter_ids = df["meter_id"].astype(str).str.strip()
+    times = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M", errors="coerce")
+    # 和单条上传一样：true/false、nan、inf 不是有效读数
+    readings = pd.to_numeric(df["reading"].map(parse_reading), errors="coerce")
+
+    hour, minute = times.dt.hour, times.dt.minute
+    maintenance = ((hour == 0) & (minute > 0)) | ((hour == 1) & (minute == 0))
+    registered = pd.Series(repository.has_users(meter_ids), index=df.index)
+
+    # 按优先级给出每条记录的错误信息，None 表示通过
+    checks = [
+        (missing, "Please fill out all blanks."),
+        (times.isna(), "Invalid time format, expected YYYY-MM-DDTHH:MM."),
+        (readings.isna(), "Reading must be a number."),
+        (~registered, "You are not registered. Please register first."),
+        (maintenance, MAINTENANCE_MESSAGE),
+    ]
+    messages = np.full(len(df), None, dtype=object)
+    for failed, message in reversed(checks):
+        messages[failed.to_numpy()] = message
+
+    ok = pd.isna(messages)
+    accepted = pd.DataFrame({
+        "meter_id": meter_ids[ok],
+        "time": times[ok].to_numpy('datetime64[s]').astype(np.int64),
+        "reading": readings[ok],
+    }).reset_index(drop=True)
+    return accepted, messages.tolist()
+
+
+@bp.route('/meterreading/batch', methods=['POST'])
+@idempotent
+def meter_reading_batch():
+    """批量上传读数（集中器一次上传整条街的电表），逐条返回处理结果。"""
+    try:
+        records = parse_batch_body()
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid batch body: {e}"}), 400
+
+    accepted, messages = validate_readings(records)
+
+    # 重发的相同读数（包括同一批里重复的）不再保存；同一时间的不同读数拒绝
+    positions = [i for i, m in enumerate(messages) if m is None]
+    statuses, previous = reading_dedup.check_and_add(accepted["meter_id"].to_numpy(), accepted["time"].to_numpy(),
+                                                     accepted["reading"].to_numpy())
+    for position, status, meter_id, epoch, seen in zip(positions, statuses, accepted["meter_id"],
+                                                       accepted["time"], previous):
+        if status != NEW and status != DUPLICATE:
+            messages[position] = conflict_message(meter_id, epoch, seen)
+    new_rows = accepted[statuses == NEW]
+    if not new_rows.empty and not executor.submit(new_rows):
+        reading_dedup.rollback(new_rows["meter_id"].to_numpy(), new_rows["time"].to_numpy())
+        return queue_full_response()
+
+    duplicates = set(np.asarray(positions)[statuses == DUPLICATE].tolist()) if positions else set()
+    results = [
+        {"index": i, "status": "error", "message": m} if m else
+        {"index": i, "status": "success", "duplicate": True} if i in duplicates else
+        {"index": i, "status": "success"}
+        for i, m in enumerate(messages)
+    ]
+    ok = sum(m is None for m in messages)
+    return jsonify({
+        "status": "success" if ok == len(records) else "partial",
+        "accepted": ok,
+        "rejected": len(records) - ok,
+        "duplicates": len(duplicates),
+        "results": results,
+    }), 200
+
+
+class UsageQueryError(Exception):
+    """用量查询失败，异常信息直接展示给用户。"""
+
+
+def resolve_date_range(time_range, start_date_str, end_date_str, now):
+    """历史查询（last_week / last_month / custom）的 (start_date, end_date)。"""
+    end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    if time_range == 'last_week':
+        start_date = end_date - timedelta(days=7)
+    elif time_range == 'last_month':
+        start_date = end_date - timedelta(days=30)
+    else:
+        # 自定义范围
+        if not (start_date_str and end_date_str):
+            raise UsageQueryError("Please provide both start and end date for custom range.")
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+            end_date = end_date.replace(hour=23, minute=59, second=59)
+        except ValueError:
+            raise UsageQueryError("Invalid date format. Please use YYYY-MM-DD.")
+    return start_date, end_date
+
+
+def today_usage(meter_id, now):
+    """今日半小时用量：从 intraday（写入时维护的当日读数）读取，相邻读数作差。返回列为 time, reading, usage 的 DataFrame。"""
+    # 只取该电表今天的读数，已按时间排序，无需读取全部读数
+    series = intraday.series(meter_id, now)
+    if series is None:
+        raise UsageQueryError(f"No meter readings for meter_id: {meter_id} today.")
+
+    times, readings = series
+    df_range = pd.DataFrame({"time": np.array(times, dtype=np.int64).astype('datetime64[s]'),
+                             "reading": np.array(readings, dtype=np.float64)})
+    # 计算半小时用量
+    df_range['usage'] = df_range['reading'].diff().fillna(0)
+    # 删除第一行以避免差值=0
+    df_range = df_range.iloc[1:]
+    if df_range.empty:
+        raise UsageQueryError("Insufficient data to calculate usage (only one reading?).")
+    return df_range
+
+
+def daily_usage(meter_id, start_date, end_date):
+    """每日用量：从每日汇总（按月分区的历史或 SQLite daily 表）读取日末次读数，相邻天作差。返回列为 date, reading, usage 的 DataFrame。"""
+    if not repository.has_daily():
+        raise UsageQueryError("No daily usage history found. No historical data yet.")
+
+    # 只读取日期范围内的行（分区内二分查找 / 主键范围查询）
+    df_range = repository.daily_range(meter_id, to_epoch(start_date), to_epoch(end_date))
+    if df_range.empty:
+        raise UsageQueryError("No daily readings found in the selected date range.")
+
+    # 相邻天差值计算每日用量（分区里每个电表每天只有一条末次读数，且已按时间排序）
+    df_daily = df_range
+    df_daily['date'] = df_daily['time'].dt.date
+    df_daily['usage'] = df_daily['reading'].diff().fillna(0)
+    return df_daily
+
+
+def usage_version(meter_id, time_range, now):
+    """(数据版本号, 最后修改时间戳)：今日数据看该电表的版本号，历史数据看分区历史的版本。"""
+    if time_range == 'today':
+        return meter_versions.get(meter_id, 0), meter_updated_at.get(meter_id)
+    version = repository.daily_version()
+    return version, version
 
-LOCAL_DB_FILE = "local_db.csv"
-DAILY_USAGE_FILE = "daily_usage.csv"
 
-import matplotlib.pyplot as plt
-@app.route('/query_usage', methods=['GET', 'POST'])
+@bp.route('/query_usage', methods=['GET', 'POST'])
 def query_usage():
     """
-    1) 如果 time_range == 'today'，从内存 data_store 里读取当日的半小时数据，做相邻读数差得到用量。
-    2) 如果 time_range in ['last_week', 'last_month', 'custom']，从 daily_usage.csv 里读取日末次读数，
+    1) 如果 time_range == 'today'，从内存 intraday 里读取当日的半小时数据，做相邻读数差得到用量。
+    2) 如果 time_range in ['last_week', 'last_month', 'custom']，从按月分区的日读数历史里读取日末次读数，
        相邻天作差得到每日用量。
     """
-    global data_store
-
     if request.method == 'GET':
         return render_template('query_usage.html', plot_url=None, total_usage=None)
 
@@ -251,213 +535,218 @@ def query_usage():
                                total_usage=None)
 
     now = datetime.now()
+    version, _ = usage_version(meter_id, time_range, now)
 
-    # ---------- 1) 今日查询：从 data_store（内存）读取半小时数据 ----------
-    if time_range == 'today':
-        df = data_store.copy()
-        if df.empty:
-            return render_template('query_usage.html',
-                                   error="No data in memory (data_store is empty).",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        df['time'] = pd.to_datetime(df['time'], errors='coerce')
-        df = df.dropna(subset=['time'])
-
-        df = df[df['meter_id'] == meter_id]
-        if df.empty:
-            return render_template('query_usage.html',
-                                   error=f"No data found for meter_id: {meter_id} today.",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        # 只取今日 00:00~23:59
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-        mask = (df['time'] >= start_date) & (df['time'] <= end_date)
-        df_range = df.loc[mask].copy()
-
-        if df_range.empty:
-            return render_template('query_usage.html',
-                                   error="No meter readings for your ID in today's date range.",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        df_range.sort_values(by='time', inplace=True)
-        df_range['reading'] = pd.to_numeric(df_range['reading'], errors='coerce').fillna(0)
-        # 计算半小时用量
-        df_range['usage'] = df_range['reading'].diff().fillna(0)
-        # 删除第一行以避免差值=0
-        df_range = df_range.iloc[1:]
-        if df_range.empty:
-            return render_template('query_usage.html',
-                                   error="Insufficient data to calculate usage (only one reading?).",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        # 生成图表
-        df_range['time_str'] = df_range['time'].dt.strftime('%m-%d %H:%M')
-        x_data = df_range['time_str'].tolist()
-        y_data = df_range['usage'].tolist()
-        total_usage = sum(y_data)
-
-        import matplotlib.pyplot as plt
-        fig, ax = plt.subplots(figsize=(10, 4))
-        bars = ax.bar(x_data, y_data, color='royalblue')
-        for bar in bars:
-            height = bar.get_height()
-            if height > 0:
-                ax.annotate(f'{height:.2f}',
-                            xy=(bar.get_x() + bar.get_width()/2, height),
-                            xytext=(0, 5),
-                            textcoords='offset points',
-                            ha='center',
-                            fontsize=9,
-                            color='black')
-        ax.set_title(f"Today's Electricity Usage (Meter {meter_id})")
-        ax.set_xlabel("Time")
-        ax.set_ylabel("Usage (kWh)")
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-
-        import io
-        import base64
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png")
-        buf.seek(0)
-        encoded = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plot_url = "data:image/png;base64," + encoded
-        plt.close(fig)
+    try:
+        # ---------- 1) 今日查询：从 intraday（内存）读取半小时数据 ----------
+        if time_range == 'today':
+            # 同一电表、同一天、数据没有变化时直接用缓存的图表
+            cache_key = (meter_id, 'today', now.date().isoformat(), version)
+            cached = chart_cache.get(cache_key)
+            if cached is not None:
+                return render_template('query_usage.html', plot_url=cached[0], total_usage=cached[1])
+
+            df_usage = today_usage(meter_id, now)
+            x_data = df_usage['time'].dt.strftime('%m-%d %H:%M').tolist()
+            title, xlabel = f"Today's Electricity Usage (Meter {meter_id})", "Time"
+
+        # ---------- 2) 上周、上月、自定义范围：从按月分区的日读数历史读取 ----------
+        else:
+            start_date, end_date = resolve_date_range(time_range, start_date_str, end_date_str, now)
+            cache_key = (meter_id, start_date.date().isoformat(), end_date.date().isoformat(), version)
+            cached = chart_cache.get(cache_key)
+            if cached is not None:
+                return render_template('query_usage.html', plot_url=cached[0], total_usage=cached[1])
+
+            df_usage = daily_usage(meter_id, start_date, end_date)
+            x_data = df_usage['date'].astype(str).tolist()
+            title, xlabel = f"Daily Electricity Usage (Meter {meter_id})", "Date"
+    except UsageQueryError as e:
+        return render_template('query_usage.html',
+                               error=str(e),
+                               plot_url=None,
+                               total_usage=None)
+
+    # 生成图表
+    y_data = df_usage['usage'].tolist()
+    total_usage = sum(y_data)
 
+    try:
+        plot_url = chart_renderer.render(x_data, y_data, title, xlabel)
+    except ChartError as e:
+        print(f"Error rendering chart for {meter_id}: {e}")
         return render_template('query_usage.html',
-                               plot_url=plot_url,
-                               total_usage=total_usage)
+                               error="The chart could not be drawn right now, please try again.",
+                               plot_url=None,
+                               total_usage=total_usage), 503
+    chart_cache.put(cache_key, (plot_url, total_usage), len(plot_url))
 
-    # ---------- 2) 上周、上月、自定义范围：从 daily_usage.csv 读取日数据 ----------
-    else:
-        if not os.path.exists(DAILY_USAGE_FILE):
-            return render_template('query_usage.html',
-                                   error="No daily_usage.csv found. No historical data yet.",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        df = pd.read_csv(DAILY_USAGE_FILE)
-        df['time'] = pd.to_datetime(df['time'], errors='coerce')
-        df = df.dropna(subset=['time'])
-
-        df = df[df['meter_id'] == meter_id]
-        if df.empty:
-            return render_template('query_usage.html',
-                                   error=f"No daily usage found for meter_id: {meter_id}",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        if time_range == 'last_week':
-            start_date = end_date - timedelta(days=7)
-        elif time_range == 'last_month':
-            start_date = end_date - timedelta(days=30)
+    return render_template('query_usage.html',
+                           plot_url=plot_url,
+                           total_usage=total_usage)
+
+
+@bp.route('/api/usage/<meter_id>', methods=['GET'])
+def api_usage(meter_id):
+    """
+    JSON 用量接口：返回 query_usage 计算出的每个时间段用量（不生成图片）。
+    参数 range=today|last_week|last_month|custom，custom 时需要 start / end（YYYY-MM-DD）。
+    ETag / Last-Modified 来自数据版本，支持条件 GET（304）。
+    """
+    meter_id = meter_id.strip()
+    time_range = request.args.get('range', 'today')
+    if time_range not in ('today', 'last_week', 'last_month', 'custom'):
+        return jsonify({"status": "error", "message": f"Unknown range: {time_range}"}), 400
+
+    now = datetime.now()
+    try:
+        if time_range == 'today':
+            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            end_date = now.replace(hour=23, minute=59, second=59, microsecond=0)
         else:
-            # 自定义范围
-            if start_date_str and end_date_str:
-                try:
-                    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-                    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-                    end_date = end_date.replace(hour=23, minute=59, second=59)
-                except ValueError:
-                    return render_template('query_usage.html',
-                                           error="Invalid date format. Please use YYYY-MM-DD.",
-                                           plot_url=None,
-                                           total_usage=None)
+            start_date, end_date = resolve_date_range(time_range, request.args.get('start', ''),
+                                                      request.args.get('end', ''), now)
+    except UsageQueryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    version, modified = usage_version(meter_id, time_range, now)
+    etag = make_etag(f"{meter_id}|{time_range}|{start_date.date()}|{end_date.date()}|{version}")
+    last_modified = datetime.fromtimestamp(modified, timezone.utc) if modified else None
+
+    # 数据没有变化：直接 304，不再计算
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        try:
+            if time_range == 'today':
+                df_usage = today_usage(meter_id, now)
+                labels = df_usage['time'].dt.strftime('%Y-%m-%dT%H:%M:%S').tolist()
             else:
-                return render_template('query_usage.html',
-                                       error="Please provide both start and end date for custom range.",
-                                       plot_url=None,
-                                       total_usage=None)
-
-        # 过滤日期
-        mask = (df['time'] >= start_date) & (df['time'] <= end_date)
-        df_range = df.loc[mask].copy()
-        if df_range.empty:
-            return render_template('query_usage.html',
-                                   error="No daily readings found in the selected date range.",
-                                   plot_url=None,
-                                   total_usage=None)
-
-        # 相邻天差值计算每日用量
-        df_range.sort_values(by='time', inplace=True)
-        df_range['reading'] = pd.to_numeric(df_range['reading'], errors='coerce').fillna(0)
-        df_range['date'] = df_range['time'].dt.date
-
-        # 如 daily_usage.csv 每日仅存储“末次读数”，可直接 groupby last()；若已是每日末次读数，可直接用
-        df_daily = df_range.groupby('date', as_index=False)['reading'].last()
-
-        df_daily.sort_values(by='date', inplace=True)
-        df_daily['usage'] = df_daily['reading'].diff().fillna(0)
-
-        x_data = df_daily['date'].astype(str).tolist()
-        y_data = df_daily['usage'].tolist()
-        total_usage = sum(y_data)
-
-        import matplotlib.pyplot as plt
-        fig, ax = plt.subplots(figsize=(10, 4))
-        bars = ax.bar(x_data, y_data, color='royalblue')
-        for bar in bars:
-            height = bar.get_height()
-            if height > 0:
-                ax.annotate(f'{height:.2f}',
-                            xy=(bar.get_x() + bar.get_width()/2, height),
-                            xytext=(0, 5),
-                            textcoords='offset points',
-                            ha='center',
-                            fontsize=9,
-                            color='black')
-        ax.set_title(f"Daily Electricity Usage (Meter {meter_id})")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Usage (kWh)")
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-
-        import io
-        import base64
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png")
-        buf.seek(0)
-        encoded = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plot_url = "data:image/png;base64," + encoded
-        plt.close(fig)
+                df_usage = daily_usage(meter_id, start_date, end_date)
+                labels = df_usage['date'].astype(str).tolist()
+        except UsageQueryError as e:
+            return jsonify({"status": "error", "message": str(e)}), 404
+
+        usage = df_usage['usage'].round(3).tolist()
+        response = jsonify({
+            "meter_id": meter_id,
+            "range": time_range,
+            "start": start_date.strftime('%Y-%m-%d'),
+            "end": end_date.strftime('%Y-%m-%d'),
+            "interval": "30min" if time_range == 'today' else "1d",
+            "time": labels,
+            "usage": usage,
+            "total_usage": round(sum(usage), 3),
+        })
+    return set_cache_headers(response, etag, last_modified)
+
+
+def make_etag(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+
+
+def set_cache_headers(response, etag, last_modified):
+    """ETag / Last-Modified，可以缓存但每次都要重新验证（条件 GET）。"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/api/usage/group', methods=['GET'])
+def api_group_usage():
+    """
+    按 region / area / community / dwelling_type 汇总的每日用量（每晚归档时增量更新，不再逐个电表扫描历史）。
+    参数 by=region|area|community|dwelling_type；name 只返回这一组（不填返回该维度的所有组）；
+    range=last_week|last_month|custom（默认 last_week），custom 时需要 start / end（YYYY-MM-DD）。
+    每组每天给出总用量、平均每个电表的用量和电表数。
+    """
+    by = request.args.get('by', '')
+    if by not in GROUP_DIMENSIONS:
+        return jsonify({"status": "error", "message": f"by must be one of: {', '.join(GROUP_DIMENSIONS)}"}), 400
+    time_range = request.args.get('range', 'last_week')
+    if time_range not in ('last_week', 'last_month', 'custom'):
+        return jsonify({"status": "error", "message": f"Unknown range: {time_range}"}), 400
+    name = request.args.get('name', '').strip() or None
 
-        return render_template('query_usage.html',
-                               plot_url=plot_url,
-                               total_usage=total_usage)
+    now = datetime.now()
+    try:
+        start_date, end_date = resolve_date_range(time_range, request.args.get('start', ''),
+                                                  request.args.get('end', ''), now)
+    except UsageQueryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    version = repository.group_usage_version()
+    etag = make_etag(f"group|{by}|{name}|{start_date.date()}|{end_date.date()}|{version}")
+    last_modified = datetime.fromtimestamp(version, timezone.utc) if version else None
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        rows = repository.group_usage(by, to_epoch(start_date) // SECONDS_PER_DAY, to_epoch(end_date) // SECONDS_PER_DAY, name)
+        if rows.empty:
+            return jsonify({"status": "error", "message": "No group usage found in the selected date range."}), 404
+        groups = []
+        for group_name, group in rows.groupby("name", sort=True):
+            groups.append({
+                "name": group_name,
+                "time": group["day"].to_numpy(dtype=np.int64).astype('datetime64[D]').astype(str).tolist(),
+                "total": group["total"].round(3).tolist(),
+                "mean": group["mean"].round(3).tolist(),
+                "meters": group["meters"].astype(int).tolist(),
+            })
+        response = jsonify({
+            "by": by,
+            "range": time_range,
+            "start": start_date.strftime('%Y-%m-%d'),
+            "end": end_date.strftime('%Y-%m-%d'),
+            "interval": "1d",
+            "groups": groups,
+        })
+    return set_cache_headers(response, etag, last_modified)
+
+
+# -------------export----------------
+
+def export_response(kind, source):
+    """流式导出：每次从存储读取 EXPORT_CHUNK_ROWS 行，编码后立即发送（分块传输，不把结果整体放进内存）。"""
+    try:
+        meter_ids, start, end, fmt = parse_export_filters(request.args)
+    except ExportError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    body, mimetype = encode_export(source(start, end, meter_ids, chunk_rows=config.EXPORT_CHUNK_ROWS), fmt)
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{export_filename(kind, request.args, fmt)}"'
+    return response
 
-# -------------user_management start----------------
 
-# 定义 CSV 文件路径
-USERS_CSV_FILE = 'users.csv'
+@bp.route('/export/readings', methods=['GET'])
+def export_readings():
+    """
+    原始读数导出。参数 meter_id（可重复或逗号分隔，不填导出所有电表）、
+    start / end（YYYY-MM-DD，含两端，不填不限）、format=csv|arrow（arrow 需要 pyarrow）。
+    """
+    return export_response("readings", repository.iter_readings)
 
-# **尝试加载本地用户数据为 DataFrame**
-if os.path.exists(USERS_CSV_FILE):
-    users = pd.read_csv(USERS_CSV_FILE, dtype={"meter_id": str})  # 强制 meter_id 为整数
-else:
-    users = pd.DataFrame(columns=[
-        "username", "meter_id", "dwelling_type", "region", "area", "community",
-        "unit", "floor", "email", "tel", "reading", "time"
-    ])
 
+@bp.route('/export/daily', methods=['GET'])
+def export_daily():
+    """每日末次读数（每晚归档的结果）导出，参数同 /export/readings。"""
+    return export_response("daily", repository.iter_daily)
 
+# -------------user_management start----------------
 
 def save_users_to_csv():
     """
-    将 `users` 数据保存到 CSV 文件，以防止数据丢失。
+    立即将用户数据中未保存的改动写入存储（csv 后端为 users.csv），以防止数据丢失。
     """
-    users.to_csv(USERS_CSV_FILE, index=False, encoding='utf-8')
+    repository.flush()
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
-    global users
     if request.method == 'GET':
         return render_template('register.html', dwelling_types=dwelling_types, regions=regions)
 
@@ -478,27 +767,59 @@ def register():
             "reading": 0,  # 初始读数设为 0
             "time": timestamp
         }])
-        if request.form['meter_id'].strip() in users['meter_id'].values:
+        if not re.fullmatch(METER_ID_PATTERN, user_data.at[0, "meter_id"]):
+            return METER_ID_MESSAGE, 400
+        # meter_id 已注册时返回 False（sqlite 后端里 meter_id 唯一，几个 worker 同时注册也只有一个成功）
+        if not repository.add_user(user_data.iloc[0].to_dict()):
             return "The Meter ID has been registered，please use other Meter ID.", 400
-
-        users = pd.concat([users, user_data], ignore_index=True)
-        save_users_to_csv()  # 保存到本地 CSV
         save_meter_id_to_csv(request.form['meter_id'].strip(), 0)  # Save the initial reading (0)
 
         user_dict = user_data.iloc[0].to_dict()
         return render_template('register_success.html', user=user_dict)
 
-@app.route('/view_user', methods=['GET', 'POST'])
+@bp.route('/register/bulk', methods=['POST'])
+def register_bulk():
+    """
+    批量注册（新小区一次导入几千户）：上传 CSV / JSON 文件（表单字段 file），或直接以
+    text/csv、application/json 作为请求体。所有行一次（向量化）校验，通过的用户一次写入，
+    逐行返回处理结果。?dry_run=1 只校验不写入。
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        data = upload.read()
+        fmt = "json" if upload.filename.lower().endswith(".json") else "csv"
+    else:
+        data = request.get_data()
+        fmt = "json" if request.is_json else ("csv" if request.mimetype == "text/csv" else None)
+    try:
+        frame = read_users(data, fmt)
+    except (ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+        return jsonify({"status": "error", "message": f"Invalid file: {e}"}), 400
+    if frame.empty:
+        return jsonify({"status": "error", "message": "No users in the file."}), 400
+
+    # 初始读数和 register() 一样交给写线程；注册很少发生，队列满时等待而不是拒绝
+    added, messages = import_users(repository, frame, dry_run=request.args.get('dry_run') == '1',
+                                   submit_readings=lambda readings: executor.submit(readings, block=True, timeout=30))
+    accepted = sum(m is None for m in messages)
+    return jsonify({
+        "status": "success" if accepted == len(messages) else "partial",
+        "accepted": accepted,
+        "rejected": len(messages) - accepted,
+        "added": len(added),
+        "results": import_results(messages, frame["meter_id"].tolist()),
+    }), 200
+
+
+@bp.route('/view_user', methods=['GET', 'POST'])
 def view_user():
-    global users
     if request.method == 'GET':
         return render_template('view_user.html')
 
     if request.method == 'POST':
         meter_id = request.form.get('meter_id', '').strip()
-        user = users[users["meter_id"] == meter_id].to_dict(orient="records")  # **转换为字典列表**
-        if user:
-            user_dict = user[0]
+        user_dict = repository.get_user(meter_id)
+        if user_dict is not None:
             return render_template('view_user.html',
                                    user_info=user_dict)
         else:
@@ -508,5 +829,75 @@ def view_user():
 
 # -------------user_management end----------------
 
+
+def load_state():
+    """
+    打开存储并把最近 DEDUP_DAYS 天的读数加载到内存（intraday、重复检查），更早的读数不进内存。只在第一次调用时执行。
+    第一次以 sqlite 模式启动时在这里导入 CSV 文件（在归档线程启动之前）。
+    """
+    with sync_lock:
+        if synced["readings"] is not None:
+            return
+        repository.open()
+        store = ReadingStore()
+        since = today_start_epoch() - (max(config.DEDUP_DAYS, 1) - 1) * SECONDS_PER_DAY
+        synced["readings"] = repository.load_readings(store, since)
+        recent = store.since(since)
+        intraday.add(*recent)   # 只保留今天的
+        reading_dedup.add(*recent)
+        # 有今天读数的电表：版本号从加载到的最新读数 id 开始（重启后不会回到 0、与重启前的 ETag 撞上）
+        bump_data_versions(pd.unique(recent[0]), version=synced["readings"])
+    print(f"Loaded {len(store)} recent readings from the {repository.name} repository")
+
+
+background = {"started": False}
+background_lock = threading.Lock()
+
+
+def start_background():
+    """
+    启动后台线程：日志写入线程、读数写线程和每日维护（默认 00:05 归档一次，启动时补跑错过的归档）。
+    由 python app4.py、wsgi.py 和 gunicorn 的 post_worker_init 在开始服务时调用；
+    其他方式运行时（例如测试客户端）在第一个请求时启动。重复调用没有影响。
+    """
+    with background_lock:
+        if background["started"]:
+            return
+        load_state()
+        request_logger.setup()
+        executor.start()
+        maintenance.start()
+        atexit.register(shutdown)
+        background["started"] = True
+
+
+@bp.before_app_request
+def ensure_background_started():
+    if not background["started"]:
+        start_background()
+
+
+def create_app():
+    """应用工厂：创建 Flask 应用、注册路由并加载数据（不启动后台线程）。"""
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    load_state()
+    return app
+
+
+def shutdown():
+    """退出时按顺序收尾：先写完队列里的读数，再保存 users.csv 并关闭存储，最后关闭日志文件。"""
+    maintenance.stop()
+    executor.stop()
+    repository.close()
+    chart_renderer.shutdown()
+    request_logger.stop()
+
+
 if __name__ == '__main__':
-    app.run(host='localhost', port=5000, debug=True)
+    # 开发用；生产环境用 gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
+    # 调试模式的自动重载会先启动一个只负责监视文件的父进程，后台线程只在真正处理请求的子进程里启动
+    if not config.DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
+    app.run(host='localhost', port=5000, debug=config.DEBUG)
@@ -0,0 +1,57 @@
+"""
+Compare two bench.run results:
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+
+Prints throughput and p50/p95/p99 of every route and mode, the rollup timings and
+startup times and peak RSS side by side, with the relative change (negative latency = faster).
+"""
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(old, new):
+    if not old or new is None:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def rows(before, after):
+    """(name, old value, new value) of every number worth comparing."""
+    for key in ("load_seconds", "calculate_daily_usage_seconds", "group_usage_seconds"):
+        yield f"rollup.{key}", before.get("rollup", {}).get(key), after.get("rollup", {}).get(key)
+    for key in ("import_app4_seconds", "create_app_seconds", "users_table_mb"):
+        yield f"startup.{key}", before.get("startup", {}).get(key), after.get("startup", {}).get(key)
+    yield ("startup.importtime.app4_ms", before.get("startup", {}).get("importtime", {}).get("app4_ms"),
+           after.get("startup", {}).get("importtime", {}).get("app4_ms"))
+    for mode, routes in after.get("modes", {}).items():
+        for route, stats in routes.items():
+            old = before.get("modes", {}).get(mode, {}).get(route, {})
+            yield f"{mode}.{route}.rps", old.get("throughput_rps"), stats.get("throughput_rps")
+            for q in ("p50", "p95", "p99"):
+                yield (f"{mode}.{route}.{q}_ms", old.get("latency_ms", {}).get(q),
+                       stats.get("latency_ms", {}).get(q))
+    yield ("peak_rss_mb.self", before.get("peak_rss_mb", {}).get("self"),
+           after.get("peak_rss_mb", {}).get("self"))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip())
+        return 2
+    before, after = load(argv[0]), load(argv[1])
+    print(f"{'':40} {str(before.get('commit'))[:10]:>12} {str(after.get('commit'))[:10]:>12}")
+    for name, old, new in rows(before, after):
+        print(f"{name:40} {old if old is not None else '-':>12} {new if new is not None else '-':>12} "
+              f"{change(old, new):>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Synthetic fixtures for the benchmarks: users.csv with N meters and local_db.csv with
+M days of half-hourly readings per meter (meter readings only ever go up).
+Everything is generated from a fixed seed, so the same arguments give the same files.
+"""
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from reading_log import format_times
+
+READINGS_PER_DAY = 48   # 每半小时一条
+DWELLING_TYPES = ["1-room / 2-room", "3-room", "4-room", "5-room and Executive",
+                  "Landed Properties", "Private Apartments and Condominiums"]
+REGIONS = ["Central", "East", "West", "North", "South"]
+USER_COLUMNS = ["username", "meter_id", "dwelling_type", "region", "area", "community",
+                "unit", "floor", "email", "tel", "reading", "time"]
+
+
+def meter_id(i):
+    """900-000-000, 900-000-001, ... (不会和仓库里的示例电表重复)"""
+    n = 900000000 + i
+    return f"{n // 1000000:03d}-{n // 1000 % 1000:03d}-{n % 1000:03d}"
+
+
+def make_users(meters, rng):
+    ids = [meter_id(i) for i in range(meters)]
+    return pd.DataFrame({
+        "username": [f"user{i}" for i in range(meters)],
+        "meter_id": ids,
+        "dwelling_type": rng.choice(DWELLING_TYPES, meters),
+        "region": rng.choice(REGIONS, meters),
+        "area": [f"Area {i % 40}" for i in range(meters)],
+        "community": [f"Community {i % 200}" for i in range(meters)],
+        "unit": [f"#{i % 20:02d}-{i % 997:03d}" for i in range(meters)],
+        "floor": (np.arange(meters) % 20 + 1).astype(str),
+        "email": [f"user{i}@example.com" for i in range(meters)],
+        "tel": [str(80000000 + i) for i in range(meters)],
+        "reading": 0.0,
+        "time": "",
+    }, columns=USER_COLUMNS)
+
+
+def make_readings(meter_ids, days, end_day, rng):
+    """Half-hourly readings of every meter for the `days` days before `end_day`, sorted by time."""
+    start = np.datetime64(end_day - timedelta(days=days), "s").astype(np.int64)
+    slots = days * READINGS_PER_DAY
+    times = start + np.arange(slots, dtype=np.int64) * 1800
+    # 每个电表每半小时用电 0-1 度，读数是累计值
+    usage = rng.random((len(meter_ids), slots)).round(2)
+    readings = np.cumsum(usage, axis=1).round(2)
+    # 按时间排序写入（与服务器按到达顺序追加一致）
+    return pd.DataFrame({
+        "meter_id": np.tile(np.asarray(meter_ids, dtype=object), slots),
+        "time": format_times(np.repeat(times, len(meter_ids))),
+        "reading": readings.T.ravel(),
+    })
+
+
+def generate(data_dir, meters, days, seed=0, end_day=None):
+    """
+    Write users.csv, local_db.csv and an empty daily_usage.csv into `data_dir`.
+    Also marks today's maintenance run as done, so importing app4 does not start a
+    catch-up archive while a benchmark is running.
+    Returns (users, readings) DataFrames.
+    """
+    rng = np.random.default_rng(seed)
+    end_day = end_day or date.today()
+    os.makedirs(data_dir, exist_ok=True)
+
+    users = make_users(meters, rng)
+    readings = make_readings(users["meter_id"].tolist(), days, end_day, rng)
+    users["reading"] = readings.drop_duplicates("meter_id", keep="last").set_index("meter_id")["reading"] \
+        .reindex(users["meter_id"]).to_numpy()
+
+    users.to_csv(os.path.join(data_dir, "users.csv"), index=False)
+    readings.to_csv(os.path.join(data_dir, "local_db.csv"), index=False)
+    pd.DataFrame(columns=["meter_id", "time", "reading"]).to_csv(os.path.join(data_dir, "daily_usage.csv"),
+                                                                 index=False)
+    with open(os.path.join(data_dir, "maintenance_state.json"), "w", encoding="utf-8") as f:
+        json.dump({"last_run_day": date.today().isoformat(),
+                   "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   "duration": None}, f)
+    return users, readings
@@ -0,0 +1,351 @@
+"""
+Benchmark of the ingest and query paths.
+
+    python -m bench.run --meters 200 --days 14 --requests 500 --out bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.compare bench/results/old.json bench/results/new.json
+
+Steps (all in a temporary data directory, the repo's own CSV files are not touched):
+  1. generate users.csv / local_db.csv with bench.fixtures (N meters x M days, half-hourly)
+  2. time data_maintenance.load_new_readings + calculate_daily_usage + calculate_group_usage
+     on the whole local_db.csv
+  3. `python -X importtime -c "import app4"` in a fresh interpreter, then import app4
+     and create_app() here (startup = replay of local_db.csv, history, users.csv)
+  4. drive /meterreading, /query_usage, /register and /view_user through the Flask
+     test client and through a real threaded WSGI server (werkzeug) over HTTP
+
+The result is one JSON document: throughput, latency percentiles and status codes
+per route and mode, rollup timings, import / startup times, the size of the users table and peak RSS.
+"""
+import argparse
+import atexit
+import contextlib
+import http.client
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from bench import fixtures  # noqa: E402
+
+ROUTES = ("meter_reading", "query_usage", "register", "view_user")
+
+
+# ---------- helpers ----------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its children (chart workers), in MB."""
+    per_mb = 1024 * 1024 if sys.platform == "darwin" else 1024   # ru_maxrss: macOS 为字节，Linux 为 KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": round(own / per_mb, 1), "children": round(children / per_mb, 1)}
+
+
+def summarize(latencies, statuses, wall):
+    latencies = np.asarray(latencies) * 1000
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall > 0 else None,
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p95": round(float(np.percentile(latencies, 95)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "max": round(float(latencies.max()), 3),
+        },
+        "status": counts,
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """app4 / data_maintenance print progress messages; keep them out of the JSON output."""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# ---------- workloads ----------
+def make_workload(route, n, meter_ids, days, rng, first_new_meter):
+    """A list of (method, path, json_body, form_body) requests for one route."""
+    today = date.today()
+    requests = []
+    for i in range(n):
+        if route == "meter_reading":
+            # 避开 00:01-01:00 维护时段
+            minute = int(rng.integers(2 * 60, 24 * 60))
+            body = {"meter_id": meter_ids[int(rng.integers(len(meter_ids)))],
+                    "time": f"{today:%Y-%m-%d}T{minute // 60:02d}:{minute % 60:02d}",
+                    "reading": round(float(rng.random() * 1000), 2)}
+            requests.append(("POST", "/meterreading", body, None))
+        elif route == "query_usage":
+            meter = meter_ids[int(rng.integers(len(meter_ids)))]
+            if i % 4 == 0:
+                form = {"meter_id": meter, "time_range": "today"}
+            else:
+                end = today - timedelta(days=int(rng.integers(1, max(days, 2))))
+                start = end - timedelta(days=7)
+                form = {"meter_id": meter, "time_range": "custom",
+                        "start_date": f"{start:%Y-%m-%d}", "end_date": f"{end:%Y-%m-%d}"}
+            requests.append(("POST", "/query_usage", None, form))
+        elif route == "register":
+            k = first_new_meter + i
+            form = {"username": f"bench{k}", "meter_id": fixtures.meter_id(k), "dwelling_type": "3-room",
+                    "region": "East", "area": "Bench", "community": "Bench", "unit": "#01-01",
+                    "floor": "1", "email": f"bench{k}@example.com", "tel": str(90000000 + k)}
+            requests.append(("POST", "/register", None, form))
+        elif route == "view_user":
+            form = {"meter_id": meter_ids[int(rng.integers(len(meter_ids)))]}
+            requests.append(("POST", "/view_user", None, form))
+    return requests
+
+
+# ---------- drivers ----------
+class TestClientDriver:
+    """Requests go straight into the WSGI app (no sockets): measures server-side cost."""
+
+    name = "testclient"
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def __call__(self, method, path, json_body, form):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json_body, data=form)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class WsgiDriver:
+    """A real threaded werkzeug server on a free port, one keep-alive connection per client thread."""
+
+    name = "wsgi"
+
+    def __init__(self, app):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self._local = threading.local()
+
+    def __call__(self, method, path, json_body, form):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        if json_body is not None:
+            body, content_type = json.dumps(json_body), "application/json"
+        else:
+            body, content_type = urllib.parse.urlencode(form or {}), "application/x-www-form-urlencoded"
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": content_type})
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # 服务器关闭了连接（例如 HTTP/1.0），重新连接再试一次
+            conn.close()
+            conn.request(method, path, body=body, headers={"Content-Type": content_type})
+            response = conn.getresponse()
+            response.read()
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_requests(driver, requests, concurrency):
+    latencies = [0.0] * len(requests)
+    statuses = [0] * len(requests)
+
+    def one(i):
+        method, path, json_body, form = requests[i]
+        started = time.perf_counter()
+        statuses[i] = driver(method, path, json_body, form)
+        latencies[i] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(len(requests))))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+# ---------- phases ----------
+def bench_rollup():
+    """Time parsing local_db.csv, calculate_daily_usage and the group aggregates on all of it (the nightly rebuild)."""
+    import data_maintenance
+    data_maintenance.repository.open()   # 分组汇总要用 users 的属性
+    started = time.perf_counter()
+    readings, _ = data_maintenance.load_new_readings(0)
+    parsed = time.perf_counter()
+    merged = data_maintenance.calculate_daily_usage(readings, rebuild=True)
+    finished = time.perf_counter()
+    data_maintenance.calculate_group_usage(merged, rebuild=True)
+    grouped = time.perf_counter()
+    return {
+        "rows": len(readings),
+        "load_seconds": round(parsed - started, 4),
+        "calculate_daily_usage_seconds": round(finished - parsed, 4),
+        "rows_per_second": round(len(readings) / (finished - parsed), 1) if finished > parsed else None,
+        "group_usage_seconds": round(grouped - finished, 4),
+    }
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from the output of python -X importtime."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue   # 表头
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return modules
+
+
+def bench_importtime(top=10):
+    """Import app4 in a fresh interpreter with -X importtime: total and the heaviest top-level imports."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app4"], cwd=REPO_DIR,
+                               env=os.environ.copy(), capture_output=True, text=True, check=True)
+    modules = parse_importtime(completed.stderr)
+    end = next((i for i, m in enumerate(modules) if m[0] == "app4" and m[3] == 0), None)
+    if end is None:
+        return {"app4_ms": None}
+    # 子模块排在父模块之前：app4 之前连续的 depth > 0 的行就是 app4 导入的模块（不含解释器启动时的 site 等）
+    start = end
+    while start > 0 and modules[start - 1][3] > 0:
+        start -= 1
+    subtree = modules[start:end]
+    heaviest = sorted((m for m in subtree if m[3] == 1), key=lambda m: -m[2])[:top]
+    return {
+        "app4_ms": round(modules[end][2] / 1000, 1),
+        "modules": len(subtree) + 1,
+        "matplotlib_imported": any(m[0] == "matplotlib" for m in subtree),
+        "heaviest_ms": {name: round(cumulative / 1000, 1) for name, _, cumulative, _ in heaviest},
+    }
+
+
+def bench_mode(app4, driver, args, meter_ids, rng, first_new_meter):
+    results = {}
+    for route in ROUTES:
+        requests = make_workload(route, args.requests, meter_ids, args.days, rng, first_new_meter)
+        results[route] = run_requests(driver, requests, args.concurrency)
+        if route == "meter_reading":
+            # 读数由写线程异步写入，单独记录清空队列的时间
+            started = time.perf_counter()
+            app4.executor.join()
+            results[route]["drain_seconds"] = round(time.perf_counter() - started, 4)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--meters", type=int, default=200)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route and mode")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", default="testclient,wsgi")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON result here (default: stdout only)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary data directory")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="elec-bench-")
+    if not args.keep:
+        # 最先注册、最后执行：等 app4 的退出处理写完文件后再删除
+        atexit.register(shutil.rmtree, data_dir, True)
+    os.environ["ELEC_DATA_DIR"] = data_dir
+    os.environ.setdefault("ELEC_LOG_FILE", os.path.join(data_dir, "server.log"))
+
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: getattr(args, k) for k in ("meters", "days", "requests", "concurrency", "seed")},
+    }
+
+    started = time.perf_counter()
+    _, readings = fixtures.generate(data_dir, args.meters, args.days, seed=args.seed)
+    result["fixtures"] = {"meters": args.meters, "readings": len(readings),
+                          "seconds": round(time.perf_counter() - started, 4)}
+
+    with quiet(not args.verbose):
+        result["rollup"] = bench_rollup()
+        importtime = bench_importtime()
+
+        started = time.perf_counter()
+        import app4
+        imported = time.perf_counter()
+        app = app4.create_app() if hasattr(app4, "create_app") else app4.app
+        result["startup"] = {"import_app4_seconds": round(imported - started, 4),
+                             "create_app_seconds": round(time.perf_counter() - imported, 4),
+                             "importtime": importtime}
+        users = app4.repository.users_frame()
+        if users is not None:
+            result["startup"]["users_table_mb"] = round(users.memory_usage(deep=True).sum() / 2 ** 20, 2)
+
+        meter_ids = [fixtures.meter_id(i) for i in range(args.meters)]
+        rng = np.random.default_rng(args.seed)
+        result["modes"] = {}
+        for n, mode in enumerate(m.strip() for m in args.modes.split(",") if m.strip()):
+            driver = {"testclient": TestClientDriver, "wsgi": WsgiDriver}[mode](app)
+            try:
+                first_new_meter = args.meters + n * args.requests   # 每个模式注册不同的新电表
+                result["modes"][mode] = bench_mode(app4, driver, args, meter_ids, rng, first_new_meter)
+            finally:
+                driver.close()
+        # 在这里收尾（写完队列、保存 users.csv），退出时就不会再有输出混进 JSON 之后
+        app4.shutdown()
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    output = json.dumps(result, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Chart rendering for query_usage.
+
+Charts are rendered in a process pool so pyplot's global (non-thread-safe) state
+never sees two requests at once, and finished charts are kept in an LRU cache
+keyed by (meter_id, range, data version). A new data version simply produces a
+new key; `invalidate()` drops a meter's old entries early.
+
+The pool starts its workers with forkserver (spawn where that is missing), not
+fork: a forked copy of a threaded server can inherit locks held by other
+threads. A pool whose worker died is replaced, and a render that takes longer
+than `timeout` seconds is abandoned (ChartError) instead of blocking the request.
+"""
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ChartError(Exception):
+    """The chart could not be rendered (worker crashed or timed out)."""
+
+
+def render_bar_chart(x_data, y_data, title, xlabel):
+    """Render a usage bar chart and return it as a data:image/png;base64 URL. Runs in a worker process."""
+    import io
+    import base64
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 4))
+    bars = ax.bar(x_data, y_data, color='royalblue')
+    for bar in bars:
+        height = bar.get_height()
+        if height > 0:
+            ax.annotate(f'{height:.2f}',
+                        xy=(bar.get_x() + bar.get_width()/2, height),
+                        xytext=(0, 5),
+                        textcoords='offset points',
+                        ha='center',
+                        fontsize=9,
+                        color='black')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Usage (kWh)")
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    encoded = base64.b64encode(buf.getvalue()).decode('utf-8')
+    return "data:image/png;base64," + encoded
+
+
+class ChartCache:
+    """Thread-safe LRU cache limited by entry count and total size of the cached chart URLs."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+    def invalidate(self, meter_ids):
+        """Drop every cached chart of the given meters (keys start with meter_id)."""
+        meter_ids = set(meter_ids)
+        with self._lock:
+            for key in [k for k in self._items if k[0] in meter_ids]:
+                self._bytes -= self._items.pop(key)[1]
+
+
+class ChartRenderer:
+    """Renders charts in a lazily created process pool (workers=0 renders in the calling thread)."""
+
+    def __init__(self, workers=2, timeout=30.0):
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _discard(self, pool):
+        """Drop a broken or stuck pool and kill its workers; the next render creates a new one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # shutdown() 不会停下正在渲染的进程：先结束它们，否则每次超时都会留下一个进程
+        if hasattr(pool, "terminate_workers"):   # Python 3.14+
+            pool.terminate_workers()
+            return
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, x_data, y_data, title, xlabel):
+        if self.workers <= 0:
+            return render_bar_chart(x_data, y_data, title, xlabel)
+        # 进程池坏了（某个渲染进程崩溃）就换一个新的再试一次
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                future = pool.submit(render_bar_chart, x_data, y_data, title, xlabel)
+                return future.result(timeout=self.timeout)
+            except BrokenProcessPool:
+                print("Chart worker died, restarting the chart process pool")
+                self._discard(pool)
+            except TimeoutError:
+                future.cancel()
+                self._discard(pool)
+                raise ChartError(f"Rendering the chart took longer than {self.timeout:g} s.")
+        raise ChartError("The chart process pool keeps crashing.")
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,76 @@
+"""
+Runtime settings. Every value can be overridden with an environment variable.
+"""
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 数据文件所在目录（默认与代码放在一起）
+DATA_DIR = os.environ.get("ELEC_DATA_DIR", BASE_DIR)
+
+LOCAL_DB_FILE = os.path.join(DATA_DIR, "local_db.csv")
+
+# 存储后端（见 repository.py）：
+#   csv    - users.csv / local_db.csv / daily_usage.csv + 分区历史（单进程，python app4.py）
+#   sqlite - 用户、读数和每日汇总保存在 SQLITE_FILE（WAL 模式），多个 worker 进程共享（gunicorn）
+# 旧名称 memory 等同于 csv
+STATE_BACKEND = os.environ.get("ELEC_STATE_BACKEND", "csv")
+SQLITE_FILE = os.path.join(DATA_DIR, "elec.sqlite3")
+
+# python app4.py 时是否开启 Flask 调试器和自动重载（重载会让后台线程在两个进程里各启动一次）
+DEBUG = os.environ.get("ELEC_DEBUG", "0") == "1"
+DAILY_USAGE_FILE = os.path.join(DATA_DIR, "daily_usage.csv")
+ROLLUP_STATE_FILE = os.path.join(DATA_DIR, "rollup_state.json")
+# 按月分区的日读数历史（data_maintenance 写入，query_usage 读取）
+HISTORY_DIR = os.path.join(DATA_DIR, "history", "daily")
+# 按 region / area / community / dwelling_type 汇总的每日用量（archive_data 增量更新，/api/usage/group 读取）
+GROUP_USAGE_FILE = os.path.join(DATA_DIR, "group_usage.csv")
+# 某天的用量 = 当天读数 - 该电表上一条日读数；上一条日读数比这更早时不计入（间隔太长，不是一天的用量）
+GROUP_USAGE_LOOKBACK_DAYS = int(os.environ.get("ELEC_GROUP_USAGE_LOOKBACK_DAYS", "31"))
+# /export/readings、/export/daily 每次从存储读取并发送的行数（内存占用与导出总量无关）
+EXPORT_CHUNK_ROWS = int(os.environ.get("ELEC_EXPORT_CHUNK_ROWS", "50000"))
+
+# local_db.csv 追加日志的 fsync 策略：
+#   batch    - 每写一批就 fsync（最安全）
+#   interval - 距上次 fsync 超过 WAL_FSYNC_INTERVAL 秒才 fsync
+#   none     - 只 flush，交给操作系统
+WAL_FSYNC = os.environ.get("ELEC_WAL_FSYNC", "batch")
+WAL_FSYNC_INTERVAL = float(os.environ.get("ELEC_WAL_FSYNC_INTERVAL", "1.0"))
+
+# 读数写入队列：队列满时返回 503 + Retry-After
+INGEST_QUEUE_SIZE = int(os.environ.get("ELEC_INGEST_QUEUE_SIZE", "10000"))
+INGEST_MAX_BATCH = int(os.environ.get("ELEC_INGEST_MAX_BATCH", "500"))
+INGEST_RETRY_AFTER = int(os.environ.get("ELEC_INGEST_RETRY_AFTER", "1"))
+# 重复读数：记住最近 DEDUP_DAYS 天（按读数时间）的 (meter_id, time)，重发的相同读数直接忽略，读数不同的拒绝（409）
+DEDUP_DAYS = int(os.environ.get("ELEC_DEDUP_DAYS", "2"))
+# 带 Idempotency-Key 头的请求：缓存最近这么多个响应（总大小不超过 IDEMPOTENCY_CACHE_BYTES），同一个 key 重发时直接返回第一次的响应
+# （每个 worker 进程各有一份：重发到另一个 worker 时会重新执行，重复的读数仍由 sqlite 的 UNIQUE 索引挡住）
+IDEMPOTENCY_CACHE_ENTRIES = int(os.environ.get("ELEC_IDEMPOTENCY_CACHE_ENTRIES", "10000"))
+IDEMPOTENCY_CACHE_BYTES = int(os.environ.get("ELEC_IDEMPOTENCY_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# users.csv 合并写入：累计 USERS_FLUSH_MAX_DIRTY 行改动或距上次写入超过 USERS_FLUSH_INTERVAL 秒才重写文件
+USERS_CSV_FILE = os.path.join(DATA_DIR, "users.csv")
+USERS_FLUSH_INTERVAL = float(os.environ.get("ELEC_USERS_FLUSH_INTERVAL", "5.0"))
+USERS_FLUSH_MAX_DIRTY = int(os.environ.get("ELEC_USERS_FLUSH_MAX_DIRTY", "10000"))
+
+# query_usage 图表：渲染进程数（0 表示在请求线程里渲染）、单张图表的渲染超时（秒）和缓存大小
+CHART_WORKERS = int(os.environ.get("ELEC_CHART_WORKERS", "2"))
+CHART_TIMEOUT = float(os.environ.get("ELEC_CHART_TIMEOUT", "30"))
+CHART_CACHE_ENTRIES = int(os.environ.get("ELEC_CHART_CACHE_ENTRIES", "256"))
+CHART_CACHE_BYTES = int(os.environ.get("ELEC_CHART_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# 每日维护（归档）：在维护时段内的运行时间，以及记录上次运行日期的文件
+MAINTENANCE_RUN_AT = os.environ.get("ELEC_MAINTENANCE_RUN_AT", "00:05")
+MAINTENANCE_STATE_FILE = os.path.join(DATA_DIR, "maintenance_state.json")
+
+# 请求日志：由后台线程以 JSON 行写入 LOG_FILE，按大小（size）或时间（time）轮转
+LOG_FILE = os.environ.get("ELEC_LOG_FILE", os.path.join(DATA_DIR, "server.log"))
+LOG_ROTATE = os.environ.get("ELEC_LOG_ROTATE", "size")
+LOG_MAX_BYTES = int(os.environ.get("ELEC_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.environ.get("ELEC_LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.environ.get("ELEC_LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("ELEC_LOG_QUEUE_SIZE", "10000"))
+# 高频路由的采样比例，例如 "/meterreading=0.1" 只记录 10% 的成功请求（错误响应总是记录）
+LOG_SAMPLE = os.environ.get("ELEC_LOG_SAMPLE", "/meterreading=1.0,/meterreading/batch=1.0")
+# 请求体里要记录的字段（其余字段如 email / tel 不写入日志）
+LOG_BODY_FIELDS = tuple(f for f in os.environ.get("ELEC_LOG_BODY_FIELDS", "meter_id,time,reading,time_range").split(",") if f)
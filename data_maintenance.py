@@ -1,88 +1,144 @@
 import pandas as pd
 import time
-import threading
 from datetime import datetime
-datetime.now().strftime("%H:%M")
-import pandas as pd
+import numpy as np
 import os
+import json
+import config
+from group_usage import update_group_usage
+from reading_store import SECONDS_PER_DAY, TIME_FORMAT, epoch_seconds
+from repository import open_repository
+from scheduler import DailyScheduler
 
 # format of daily_usage.csv
 data_columns = ["meter_id", "time", "reading"]
 
 
-current_dir = os.path.dirname(os.path.abspath(__file__))  
-LOCAL_DB_FILE = os.path.join(current_dir, "local_db.csv")
-DAILY_USAGE_FILE = os.path.join(current_dir, "daily_usage.csv")
+# watermark: how far the readings have been rolled up
+# (byte offset in local_db.csv, or the last readings.id with the sqlite backend)
+ROLLUP_STATE_FILE = config.ROLLUP_STATE_FILE
+
+# users, readings and daily rollups (csv files or SQLite, see repository.py)
+repository = open_repository()
 
-# load `local_db.csv`
-def load_data_store():
+# rollup watermark
+def load_rollup_state():
     try:
-        return pd.read_csv(LOCAL_DB_FILE)
-    except FileNotFoundError:
-        return pd.DataFrame(columns=data_columns)
+        with open(ROLLUP_STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_rollup_state(state):
+    tmp_path = ROLLUP_STATE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, ROLLUP_STATE_FILE)
+
+# load only the readings appended after the watermark `offset`
+def load_new_readings(offset):
+    """
+    Return (new readings, new offset), with the time column as int64 epoch seconds.
+    """
+    return repository.new_readings(offset)
 
 # get daily electrivity usage
-def calculate_daily_usage(data_store):
-    """Calculate daily usage from data_store"""
+def calculate_daily_usage(data_store, rebuild=False):
+    """
+    Roll up readings into the daily table of the repository (last reading per
+    meter per day): daily_usage.csv plus the month partitions, or the SQLite
+    daily table. Only `data_store` is sorted; the result is merged into the
+    existing table, where for the same meter and day the row with the latest
+    time wins. With rebuild=True the table is rewritten from `data_store` instead.
+    Returns the (meter_ids, times) merged, or None if there was nothing to merge.
+    """
     if data_store.empty:
         print("No data available for daily usage calculation.")
+        return None
+
+    meter_ids = data_store["meter_id"].astype(str).to_numpy().astype(str)
+    times, valid = epoch_seconds(data_store["time"])
+    readings = pd.to_numeric(data_store["reading"], errors='coerce').to_numpy(dtype=np.float64)
+    valid &= ~np.isnan(readings)
+    meter_ids, times, readings = meter_ids[valid], times[valid], readings[valid]
+
+    # sort by (meter_id, day, time) and keep the last reading of each (meter_id, day)
+    days = times // SECONDS_PER_DAY
+    order = np.lexsort((times, days, meter_ids))
+    meter_ids, times, readings, days = meter_ids[order], times[order], readings[order], days[order]
+    last = np.ones(len(times), dtype=bool)
+    last[:-1] = (meter_ids[1:] != meter_ids[:-1]) | (days[1:] != days[:-1])
+    meter_ids, times, readings = meter_ids[last], times[last], readings[last]
+
+    repository.merge_daily(meter_ids, times, readings, replace=rebuild)
+    print(f"Daily usage data updated with {len(times)} records")
+    return meter_ids, times
+
+
+# region / area / community / dwelling_type aggregates of the days just merged
+def calculate_group_usage(merged, rebuild=False):
+    """Recompute the group aggregates of the affected days (every day on a rebuild)."""
+    if rebuild:
+        days = update_group_usage(repository, lookback_days=config.GROUP_USAGE_LOOKBACK_DAYS)
+    elif merged is not None:
+        days = update_group_usage(repository, *merged, lookback_days=config.GROUP_USAGE_LOOKBACK_DAYS)
+    else:
         return
-
-    data_store["time"] = pd.to_datetime(data_store["time"])
-    
-    data_store['date'] = data_store['time'].dt.date
-    latest_readings = (data_store.sort_values('time')
-                      .groupby(['meter_id', 'date'])
-                      .last()
-                      .reset_index())
-    
-    latest_readings['time'] = latest_readings['time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-    latest_readings = latest_readings[['meter_id', 'time', 'reading']]
-
-    latest_readings.to_csv(DAILY_USAGE_FILE, index=False)
-    
-    print(f"Daily usage data updated with {len(latest_readings)} records")
+    print(f"Group usage updated for {days} days")
 
 
 # archive `data_store` 
 def archive_data():
-    data_store = load_data_store()
+    """Incremental rollup: only readings after the persisted watermark are processed."""
+    repository.open()
+    state = load_rollup_state()
+    offset = state["offset"] if state else 0
+    size = repository.readings_end()
+    # no watermark yet, the readings were replaced or the backend changed: rebuild the daily table from scratch
+    backend = state.get("backend", "csv") if state else None
+    rebuild = state is None or offset > size or {"memory": "csv"}.get(backend, backend) != repository.name
+    if rebuild:
+        offset = 0
+
+    data_store, new_offset = load_new_readings(offset)
+    # the group aggregates did not exist yet: build them from the whole daily table
+    rebuild_groups = rebuild or repository.group_usage_version() is None
     if data_store.empty:
         print(" No unarchived data found.")
+        if rebuild_groups:
+            calculate_group_usage(None, rebuild=True)
+        save_rollup_state({"offset": new_offset, "backend": repository.name,
+                           "updated": datetime.now().strftime(TIME_FORMAT)})
         return
 
     try:
         # daily_usage for calculation
-        calculate_daily_usage(data_store)
-        # clear data_store
-        print(" Data store cleared after archiving.")
+        merged = calculate_daily_usage(data_store, rebuild=rebuild)
+        calculate_group_usage(merged, rebuild=rebuild_groups)
+        # move the watermark past the archived readings
+        save_rollup_state({"offset": new_offset, "backend": repository.name,
+                           "updated": datetime.now().strftime(TIME_FORMAT)})
+        print(f" Archived {len(data_store)} new readings.")
 
     except Exception as e:
         print(f" Error archiving data: {e}")
+        raise
+
+
+# runs archive_data once a day at MAINTENANCE_RUN_AT (inside the 00:00-01:00 window)
+maintenance = DailyScheduler(archive_data, config.MAINTENANCE_STATE_FILE,
+                             run_at=config.MAINTENANCE_RUN_AT, name="Data maintenance")
 
 # Check for unarchived data at power-up and performs archiving
 def check_and_archive_on_startup():
+    """Catch up a nightly run missed while the system was down (at most once per day)."""
     print(" System startup: Checking for unarchived data...")
-    archive_data()
-
-
-# archive from 00:00 to 00:59 every day
-def maintenance_scheduler():
-    while True:
-        #current_time = "01:00"
-        current_time = datetime.now().strftime("%H:%M")
-        if "00:00" <= current_time <= "00:59":
-            print(" Midnight maintenance started...")
-            archive_data()
-            time.sleep(60)
-
-        time.sleep(10)
+    if not maintenance.run_if_due():
+        print(" Nightly archive already done for today.")
 
 # start thread
 def start_maintenance_thread():
-    maintenance_thread = threading.Thread(target=maintenance_scheduler, daemon=True)
-    maintenance_thread.start()
-    print(" Data maintenance thread started.")
+    maintenance.start()
 
 #  data archive during maintenance time and after turn on
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+Daily usage aggregated by user attributes (region, area, community, dwelling_type).
+
+A meter's usage on a day is its daily reading minus its previous daily reading
+(if that is at most `lookback_days` old -- a longer gap is not one day's usage).
+The nightly archive joins these per-meter usages with the users table and keeps,
+for every dimension, group and day: total usage, mean usage per meter and the
+number of meters. Only the days touched by the new readings (and the days whose
+"previous reading" they changed) are recomputed; the result is stored through the
+repository and read by /api/usage/group.
+"""
+import numpy as np
+import pandas as pd
+
+from reading_store import SECONDS_PER_DAY
+
+GROUP_DIMENSIONS = ("region", "area", "community", "dwelling_type")
+GROUP_USAGE_COLUMNS = ["dimension", "name", "day", "total", "mean", "meters"]
+
+
+def meter_daily_usage(meter_ids, times, readings, lookback_days=31):
+    """
+    Usage of every daily row whose meter has an earlier row at most `lookback_days`
+    before it: (meter_ids, days, previous_days, usage), sorted by (meter_id, day).
+    """
+    meter_ids = np.asarray(meter_ids, dtype=object).astype(str)
+    days = np.asarray(times, dtype=np.int64) // SECONDS_PER_DAY
+    readings = np.asarray(readings, dtype=np.float64)
+    order = np.lexsort((days, meter_ids))
+    meter_ids, days, readings = meter_ids[order], days[order], readings[order]
+    same = (meter_ids[1:] == meter_ids[:-1]) & (days[1:] - days[:-1] <= lookback_days)
+    return (meter_ids[1:][same], days[1:][same], days[:-1][same],
+            (readings[1:] - readings[:-1])[same])
+
+
+def aggregate(meter_ids, days, usage, users):
+    """Group totals / means / meter counts per dimension and day (meters without a user row are skipped)."""
+    frame = pd.DataFrame({"meter_id": meter_ids, "day": days, "usage": usage})
+    frame = frame.merge(users[["meter_id", *GROUP_DIMENSIONS]].drop_duplicates("meter_id"),
+                        on="meter_id", how="inner")
+    parts = []
+    for dimension in GROUP_DIMENSIONS:
+        grouped = frame.groupby([dimension, "day"])["usage"].agg(["sum", "mean", "count"]).reset_index()
+        parts.append(pd.DataFrame({
+            "dimension": dimension,
+            "name": grouped[dimension].astype(str),
+            "day": grouped["day"].astype(np.int64),
+            "total": grouped["sum"].round(3),
+            "mean": grouped["mean"].round(3),
+            "meters": grouped["count"].astype(np.int64),
+        }, columns=GROUP_USAGE_COLUMNS))
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=GROUP_USAGE_COLUMNS)
+
+
+def update_group_usage(repository, meter_ids=None, times=None, lookback_days=31):
+    """
+    Recompute the group aggregates after `meter_ids` / `times` were merged into the
+    daily table. Without them (a rebuild) every day is recomputed from the whole table.
+    Returns the number of days written.
+    """
+    users = repository.users_frame()
+    if users is None or users.empty:
+        return 0
+
+    if meter_ids is None:
+        rows = repository.daily_rows(np.iinfo(np.int64).min, np.iinfo(np.int64).max)
+        m, days, _, usage = meter_daily_usage(*rows, lookback_days=lookback_days)
+        repository.replace_group_usage(aggregate(m, days, usage, users), days=None)
+        return len(np.unique(days))
+
+    touched_days = np.unique(np.asarray(times, dtype=np.int64) // SECONDS_PER_DAY)
+    if len(touched_days) == 0:
+        return 0
+    # 读取前后 lookback_days 天：受影响的天的上一条日读数都在这个窗口里
+    start = (int(touched_days[0]) - lookback_days) * SECONDS_PER_DAY
+    end = (int(touched_days[-1]) + lookback_days + 1) * SECONDS_PER_DAY - 1
+    m, days, previous_days, usage = meter_daily_usage(*repository.daily_rows(start, end),
+                                                      lookback_days=lookback_days)
+
+    # 受影响的天：新读数所在的天，以及上一条日读数是新读数的那些天（通常是第二天）
+    touched = pd.MultiIndex.from_arrays([np.asarray(meter_ids, dtype=object).astype(str),
+                                         np.asarray(times, dtype=np.int64) // SECONDS_PER_DAY])
+    changed = (pd.MultiIndex.from_arrays([m, days]).isin(touched)
+               | pd.MultiIndex.from_arrays([m, previous_days]).isin(touched))
+    affected = np.union1d(touched_days, days[changed])
+    keep = np.isin(days, affected)
+    repository.replace_group_usage(aggregate(m[keep], days[keep], usage[keep], users), days=affected)
+    return len(affected)
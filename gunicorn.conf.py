@@ -0,0 +1,33 @@
+"""
+gunicorn settings:  gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker imports app4 itself (no preload) and starts its background threads
+(ingest writer, maintenance scheduler, log listener) in post_worker_init, so they
+and the SQLite connections are created after the fork. State is shared through SQLite in WAL mode; the daily archive is
+still run by only one worker thanks to the scheduler's lock file.
+/metrics reports the worker that answered (label worker="<pid>"); scrape every
+worker or aggregate over that label.
+"""
+import multiprocessing
+import os
+
+# 多个 worker 必须共享状态
+os.environ.setdefault("ELEC_STATE_BACKEND", "sqlite")
+
+bind = os.environ.get("ELEC_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("ELEC_WEB_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.environ.get("ELEC_WEB_THREADS", "4"))
+preload_app = False
+timeout = 60
+graceful_timeout = 30
+
+if workers > 1 and os.environ["ELEC_STATE_BACKEND"] != "sqlite":
+    raise RuntimeError("ELEC_STATE_BACKEND=csv keeps users and readings in process memory; "
+                       "use sqlite (or ELEC_WEB_WORKERS=1) when running several workers")
+
+
+def post_worker_init(worker):
+    # 应用已在 worker 里加载，开始服务前启动后台线程
+    import app4
+    app4.start_background()
@@ -0,0 +1,310 @@
+"""
+Date-partitioned on-disk history of daily readings.
+
+Every month of daily rollups is one partition directory (e.g. history/daily/2025-02.v3/,
+a new version directory each time the month is rewritten) holding three NumPy
+columns sorted by (meter_id, time):
+
+    meter_id.npy   fixed-width unicode
+    time.npy       int64 epoch seconds
+    reading.npy    float64
+
+plus a per-meter index built at write time:
+
+    index_meters.npy   distinct meter_ids, sorted
+    index_starts.npy   offset of each meter's first row (one extra entry = row count)
+
+manifest.json records rows and min/max time / meter_id for every partition, so a
+query only opens the partitions that overlap the requested date range. Inside a
+partition a meter is found by binary search on index_meters and its date range
+by binary search on its (sorted) times, so one meter's month costs about as much
+as reading its ~30 rows. Partitions are memory-mapped and cached across queries.
+"""
+import contextlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from reading_store import SECONDS_PER_DAY
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+MANIFEST = "manifest.json"
+COLUMNS = ("meter_id", "time", "reading")
+INDEX_FILES = ("index_meters", "index_starts")
+
+
+def build_meter_index(meter_ids):
+    """(distinct meter_ids, start offsets) for a meter_id column that is already sorted."""
+    if len(meter_ids) == 0:
+        return np.empty(0, dtype=meter_ids.dtype), np.zeros(1, dtype=np.int64)
+    first = np.flatnonzero(np.r_[True, meter_ids[1:] != meter_ids[:-1]])
+    starts = np.append(first, len(meter_ids)).astype(np.int64)
+    return meter_ids[first], starts
+
+
+class DailyHistory:
+    def __init__(self, root):
+        self.root = root
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._open_partitions = {}   # name -> (version, columns, index)，内存映射的分区
+        self._write_mutex = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._refresh()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        """
+        Serialize writers across threads and processes (several gunicorn workers share
+        the same history directory). Re-entrant within one process.
+        """
+        with self._write_mutex:
+            if self._lock_depth == 0 and fcntl is not None:
+                os.makedirs(os.path.dirname(self.root) or ".", exist_ok=True)
+                self._lock_file = open(self.root + ".lock", "a")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    # ---------- manifest ----------
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def _refresh(self):
+        """Reload manifest.json if another process (the maintenance job) rewrote it."""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except FileNotFoundError:
+            self._manifest, self._manifest_mtime = {}, None
+            return
+        if mtime != self._manifest_mtime:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.path.getmtime(self.manifest_path)
+
+    @property
+    def version(self):
+        """Changes whenever the maintenance job rewrites the history (used in cache keys)."""
+        self._refresh()
+        return self._manifest_mtime
+
+    def partitions(self):
+        self._refresh()
+        return dict(self._manifest)
+
+    # ---------- partition files ----------
+    def _partition_dir(self, name, meta=None):
+        meta = meta if meta is not None else self._manifest[name]
+        return os.path.join(self.root, meta.get("path", name))
+
+    def read_partition(self, name):
+        path = self._partition_dir(name)
+        return tuple(np.load(os.path.join(path, f"{c}.npy")) for c in COLUMNS)
+
+    def open_partition(self, name):
+        """Memory-mapped (columns, index) of a partition, cached until it is rewritten."""
+        try:
+            return self._open_partition(name)
+        except FileNotFoundError:
+            # 另一个进程刚刚替换了这个分区并删除了旧版本目录：重新读取 manifest 再打开
+            self._manifest_mtime = None
+            self._refresh()
+            return self._open_partition(name)
+
+    def _open_partition(self, name):
+        meta = self._manifest[name]
+        version = meta.get("version", 0)
+        cached = self._open_partitions.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        path = self._partition_dir(name, meta)
+        columns = tuple(np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in COLUMNS)
+        if all(os.path.exists(os.path.join(path, f"{f}.npy")) for f in INDEX_FILES):
+            index = tuple(np.load(os.path.join(path, f"{f}.npy"), mmap_mode="r") for f in INDEX_FILES)
+        else:
+            # 旧分区没有索引文件，临时在内存中构建
+            index = build_meter_index(np.asarray(columns[0]))
+        self._open_partitions[name] = (version, columns, index)
+        return columns, index
+
+    def open_all(self):
+        """Memory-map every partition (called once at startup)."""
+        for name in self.partitions():
+            self.open_partition(name)
+        return len(self._open_partitions)
+
+    def _write_partition(self, name, meter_ids, times, readings, old_meta):
+        """
+        Write a new version of a partition into its own directory (e.g. 2025-02.v3) and
+        return its manifest entry. Readers keep using the old directory until the
+        manifest is switched, so they never see a half-written partition.
+        """
+        version = (old_meta or {}).get("version", 0) + 1
+        dirname = f"{name}.v{version}"
+        path = os.path.join(self.root, dirname)
+        os.makedirs(path, exist_ok=True)
+        index_meters, index_starts = build_meter_index(meter_ids)
+        files = zip(COLUMNS + INDEX_FILES, (meter_ids, times, readings, index_meters, index_starts))
+        for column, values in files:
+            np.save(os.path.join(path, f"{column}.npy"), values)
+        return {
+            "path": dirname,
+            "version": version,
+            "rows": int(len(times)),
+            "min_time": int(times.min()),
+            "max_time": int(times.max()),
+            "min_meter": str(meter_ids[0]),
+            "max_meter": str(meter_ids[-1]),
+        }
+
+    # ---------- write path (maintenance job) ----------
+    def clear(self):
+        with self.write_lock():
+            if os.path.exists(self.root):
+                shutil.rmtree(self.root)
+            self._manifest, self._manifest_mtime = {}, None
+            self._open_partitions = {}
+
+    def merge(self, meter_ids, times, readings, replace=False):
+        """
+        Merge daily rows into their month partitions. For the same meter and day the
+        row with the latest time is kept. Only the touched partitions are rewritten.
+        With replace=True the rows replace the whole history instead (a rebuild); the
+        old partitions stay readable until the new manifest is in place.
+        """
+        with self.write_lock():
+            self._merge(meter_ids, times, readings, replace)
+
+    def _merge(self, meter_ids, times, readings, replace):
+        os.makedirs(self.root, exist_ok=True)
+        self._refresh()
+        meter_ids = np.asarray(meter_ids, dtype=str)
+        times = np.asarray(times, dtype=np.int64)
+        readings = np.asarray(readings, dtype=np.float64)
+        months = times.astype('datetime64[s]').astype('datetime64[M]')
+
+        old_manifest = dict(self._manifest)
+        manifest = {} if replace else dict(old_manifest)
+        replaced = [self._partition_dir(name) for name in old_manifest] if replace else []
+        for month in np.unique(months):
+            name = str(month)
+            in_month = months == month
+            parts = [(meter_ids[in_month], times[in_month], readings[in_month])]
+            if name in manifest:
+                parts.insert(0, self.read_partition(name))
+                replaced.append(self._partition_dir(name))
+            m = np.concatenate([p[0] for p in parts]).astype(str)
+            t = np.concatenate([p[1] for p in parts])
+            r = np.concatenate([p[2] for p in parts])
+
+            # 按 (meter_id, 日期, 时间) 排序后，每个 (meter_id, 日期) 保留最后一条
+            days = t // SECONDS_PER_DAY
+            order = np.lexsort((t, days, m))
+            m, t, r, days = m[order], t[order], r[order], days[order]
+            last = np.ones(len(m), dtype=bool)
+            last[:-1] = (m[1:] != m[:-1]) | (days[1:] != days[:-1])
+            manifest[name] = self._write_partition(name, m[last], t[last], r[last], old_manifest.get(name))
+
+        # 新 manifest 一次性替换，之后再删除旧版本目录（已映射的旧文件在 Linux 上仍然可读）
+        self._manifest = manifest
+        self._write_manifest()
+        for path in replaced:
+            shutil.rmtree(path, ignore_errors=True)
+
+    # ---------- read path (query_usage) ----------
+    def overlapping(self, start, end, meter_id=None):
+        """Names of partitions whose time (and meter_id) range overlaps the query."""
+        self._refresh()
+        names = []
+        for name, meta in sorted(self._manifest.items()):
+            if meta["max_time"] < start or meta["min_time"] > end:
+                continue
+            if meter_id is not None and not (meta["min_meter"] <= meter_id <= meta["max_meter"]):
+                continue
+            names.append(name)
+        return names
+
+    def load_days(self, start, end):
+        """Daily rows of every meter with start <= time <= end: (meter_ids, times, readings)."""
+        parts = []
+        for name in self.overlapping(start, end):
+            meter_ids, times, readings = self.open_partition(name)[0]
+            keep = (times >= start) & (times <= end)
+            parts.append((np.asarray(meter_ids)[keep].astype(object), np.asarray(times)[keep],
+                          np.asarray(readings)[keep]))
+        if not parts:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def iter_days(self, start, end, meter_ids=None, chunk_rows=100_000):
+        """
+        Daily rows with start <= time <= end (only of `meter_ids` if given), partition by
+        partition in chunks of at most `chunk_rows`: yields (meter_ids, times, readings).
+        Only slices of the memory-mapped columns are read, never a whole partition.
+        """
+        wanted = None if meter_ids is None else np.unique(np.asarray(meter_ids, dtype=str))
+        for name in self.overlapping(start, end):
+            (ids, times, readings), (index_meters, index_starts) = self.open_partition(name)
+            if wanted is None:
+                ranges = [(0, len(times))]
+            else:
+                # 用分区索引只读取所选电表的行
+                i = np.searchsorted(index_meters, wanted)
+                hit = i < len(index_meters)
+                i = i[hit][np.asarray(index_meters)[i[hit]] == wanted[hit]]
+                ranges = [(int(index_starts[k]), int(index_starts[k + 1])) for k in i]
+            for lo, hi in ranges:
+                for first in range(lo, hi, chunk_rows):
+                    last = min(first + chunk_rows, hi)
+                    chunk_times = np.asarray(times[first:last])
+                    keep = (chunk_times >= start) & (chunk_times <= end)
+                    if keep.any():
+                        yield (np.asarray(ids[first:last])[keep].astype(object), chunk_times[keep],
+                               np.asarray(readings[first:last])[keep])
+
+    def load_range(self, meter_id, start, end):
+        """Daily rows of one meter with start <= time <= end (epoch seconds), sorted by time."""
+        times_out, readings_out = [], []
+        for name in self.overlapping(start, end, meter_id):
+            (_, times, readings), (index_meters, index_starts) = self.open_partition(name)
+            i = np.searchsorted(index_meters, meter_id)
+            if i == len(index_meters) or index_meters[i] != meter_id:
+                continue
+            lo, hi = int(index_starts[i]), int(index_starts[i + 1])
+            # 该电表的行按时间有序，二分查找日期范围
+            meter_times = times[lo:hi]
+            first = lo + int(np.searchsorted(meter_times, start, side="left"))
+            last = lo + int(np.searchsorted(meter_times, end, side="right"))
+            times_out.append(np.array(times[first:last]))
+            readings_out.append(np.array(readings[first:last]))
+        times = np.concatenate(times_out) if times_out else np.empty(0, dtype=np.int64)
+        readings = np.concatenate(readings_out) if readings_out else np.empty(0, dtype=np.float64)
+        return pd.DataFrame({"time": times.astype('datetime64[s]'), "reading": readings})
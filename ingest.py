@@ -0,0 +1,74 @@
+"""
+Ingest pipeline: one bounded queue drained by a single writer thread.
+
+Request handlers only validate and enqueue; the writer thread is the only code
+that mutates the reading store, so no locking is needed around it. The writer
+drains whatever is queued (up to `max_batch` items) and applies it as one
+micro-batch. When the queue is full `submit()` returns False and the caller
+should answer 503 with Retry-After.
+"""
+import queue
+import threading
+
+_STOP = object()
+
+
+class IngestQueue:
+    def __init__(self, apply_batch, maxsize=10000, max_batch=500):
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, item, block=False, timeout=None):
+        """Enqueue one item. Returns False if the queue is full."""
+        try:
+            self._queue.put(item, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    @property
+    def maxsize(self):
+        return self._queue.maxsize
+
+    def join(self):
+        """Block until everything submitted so far has been applied."""
+        self._queue.join()
+
+    def stop(self):
+        """Apply what is still queued, then stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is _STOP for item in batch)
+            items = [item for item in batch if item is not _STOP]
+            try:
+                if items:
+                    self.apply_batch(items)
+            except Exception as e:
+                print(f"Error applying ingest batch of {len(items)} items: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
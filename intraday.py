@@ -0,0 +1,69 @@
+"""
+Per-meter "today" readings, maintained by the ingest writer.
+
+For every meter that reported today we keep its readings sorted by time, so a
+'today' query costs O(readings of that meter) instead of a scan of the whole
+store. Readings for any other day are ignored here; the structure resets
+itself at midnight.
+"""
+import bisect
+import threading
+
+from reading_store import SECONDS_PER_DAY, today_start_epoch
+
+
+class MeterDay:
+    __slots__ = ("times", "readings")
+
+    def __init__(self):
+        self.times = []
+        self.readings = []
+
+    def add(self, t, reading):
+        if not self.times or t >= self.times[-1]:
+            # 绝大多数读数按时间顺序到达，直接追加
+            self.times.append(t)
+            self.readings.append(reading)
+        else:
+            i = bisect.bisect_right(self.times, t)
+            self.times.insert(i, t)
+            self.readings.insert(i, reading)
+
+
+class IntradayIndex:
+    def __init__(self):
+        self._day_start = today_start_epoch()
+        self._meters = {}
+        self._lock = threading.Lock()
+
+    def _roll(self, now=None):
+        day_start = today_start_epoch(now)
+        if day_start != self._day_start:
+            self._day_start = day_start
+            self._meters = {}
+
+    def add(self, meter_ids, times, readings):
+        """Add a batch of readings (times in epoch seconds); only today's are kept."""
+        with self._lock:
+            self._roll()
+            lo, hi = self._day_start, self._day_start + SECONDS_PER_DAY
+            meters = self._meters
+            for meter_id, t, reading in zip(meter_ids, times, readings):
+                t = int(t)
+                if lo <= t < hi:
+                    day = meters.get(meter_id)
+                    if day is None:
+                        day = meters[meter_id] = MeterDay()
+                    day.add(t, float(reading))
+
+    def series(self, meter_id, now=None):
+        """Copy of today's (times, readings) for one meter, sorted by time; None if it has none."""
+        with self._lock:
+            self._roll(now)
+            day = self._meters.get(meter_id)
+            if day is None:
+                return None
+            return list(day.times), list(day.readings)
+
+    def __len__(self):
+        return len(self._meters)
@@ -0,0 +1,123 @@
+"""
+In-process request metrics exposed at /metrics in Prometheus text format.
+
+Every request is recorded under its Flask endpoint (meter_reading, query_usage, ...):
+a request counter, an error counter (status >= 500 counts as an error, 4xx as a
+client error) and a latency summary. Latency quantiles (p50/p95/p99) are computed
+at scrape time from the last `window` samples of each route, so recording a request
+is one lock + a ring-buffer write. Gauges and counters kept elsewhere are
+callbacks read at scrape time.
+
+The numbers belong to one process. Under gunicorn every worker has its own
+Metrics, so every series carries a worker="<pid>" label: a scrape through the
+load balancer reaches one worker, and totals are sum by (route) over all workers.
+"""
+import math
+import os
+import threading
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RouteStats:
+    __slots__ = ("count", "errors", "client_errors", "total_seconds", "samples", "next_sample")
+
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.client_errors = 0
+        self.total_seconds = 0.0
+        self.samples = np.full(window, np.nan)
+        self.next_sample = 0
+
+    def record(self, seconds, status):
+        self.count += 1
+        self.total_seconds += seconds
+        if status >= 500:
+            self.errors += 1
+        elif status >= 400:
+            self.client_errors += 1
+        self.samples[self.next_sample] = seconds
+        self.next_sample = (self.next_sample + 1) % len(self.samples)
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    return repr(float(value))
+
+
+class Metrics:
+    def __init__(self, prefix="elec", window=1024):
+        self.prefix = prefix
+        self.window = window
+        self._routes = {}
+        self._gauges = []   # (name, help, fn, type)
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds, status):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats(self.window)
+            stats.record(seconds, status)
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value is `fn()` at scrape time."""
+        self._gauges.append((name, help_text, fn, "gauge"))
+
+    def counter(self, name, help_text, fn):
+        """Register a counter (a value that only goes up, e.g. since the process started) read with `fn()`."""
+        self._gauges.append((name + "_total", help_text, fn, "counter"))
+
+    def snapshot(self):
+        """{route: {count, errors, client_errors, sum, p50, p95, p99}} (seconds)."""
+        with self._lock:
+            routes = {route: (s.count, s.errors, s.client_errors, s.total_seconds, s.samples.copy())
+                      for route, s in self._routes.items()}
+        result = {}
+        for route, (count, errors, client_errors, total, samples) in routes.items():
+            samples = samples[~np.isnan(samples)]
+            quantiles = np.quantile(samples, QUANTILES) if len(samples) else [math.nan] * len(QUANTILES)
+            result[route] = {"count": count, "errors": errors, "client_errors": client_errors, "sum": total}
+            for q, value in zip(QUANTILES, quantiles):
+                result[route][f"p{int(q * 100)}"] = float(value)
+        return result
+
+    def render(self):
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        p = self.prefix
+        worker = f'worker="{os.getpid()}"'
+        routes = sorted(self.snapshot().items())
+        lines = [
+            f"# HELP {p}_request_latency_seconds Request latency by route (quantiles over the last {self.window} requests).",
+            f"# TYPE {p}_request_latency_seconds summary",
+        ]
+        for route, s in routes:
+            for q in QUANTILES:
+                lines.append(f'{p}_request_latency_seconds{{{worker},route="{route}",quantile="{q}"}} '
+                             f'{_format_value(s[f"p{int(q * 100)}"])}')
+            lines.append(f'{p}_request_latency_seconds_sum{{{worker},route="{route}"}} {_format_value(s["sum"])}')
+            lines.append(f'{p}_request_latency_seconds_count{{{worker},route="{route}"}} {s["count"]}')
+
+        for name, key, help_text in (
+            ("requests_total", "count", "Requests handled, by route."),
+            ("request_errors_total", "errors", "Requests answered with a 5xx status, by route."),
+            ("request_client_errors_total", "client_errors", "Requests answered with a 4xx status, by route."),
+        ):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} counter")
+            for route, s in routes:
+                lines.append(f'{p}_{name}{{{worker},route="{route}"}} {s[key]}')
+
+        for name, help_text, fn, kind in self._gauges:
+            try:
+                value = fn()
+            except Exception:   # 某个 gauge 出错不影响其余指标
+                value = None
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            lines.append(f"{p}_{name}{{{worker}}} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
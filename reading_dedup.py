@@ -0,0 +1,244 @@
+"""
+Duplicate suppression for incoming readings.
+
+Concentrators retry POST /meterreading on timeouts, so the same (meter_id, time)
+can arrive several times. ReadingDedup remembers the readings of the last `days`
+days (by reading time) and tells, for every incoming reading:
+
+    NEW         not seen yet -- store it
+    DUPLICATE   same meter, time and reading already stored -- absorb it silently
+    CONFLICT    same meter and time but a different reading -- reject and flag it
+
+One day of keys is two sorted NumPy columns (key = meter code * 86400 + second
+of the day, reading) plus a small dict of recent additions that is merged into
+the columns once it grows past 1/8 of them, so a day costs ~16 bytes per reading
+and a lookup is one binary search. The window follows the clock; older days are
+dropped, and readings outside the window are not checked (let through as NEW).
+
+IdempotencyCache keeps the responses of the last requests that carried an
+Idempotency-Key header, so a retried request gets the first response back.
+
+Both are per worker process. With the sqlite backend the readings table is
+UNIQUE on (meter_id, time), so a retry that reaches another worker before it
+synced the first copy is still stored only once: the writer thread skips the
+row and counts it with record(). A retried Idempotency-Key request that lands
+on another worker runs again, and its readings are deduplicated the same way.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from reading_store import SECONDS_PER_DAY, to_epoch
+
+NEW, DUPLICATE, CONFLICT = 0, 1, 2
+MERGE_MIN = 4096
+
+
+class _DaySet:
+    """key -> reading for one day: sorted arrays + dict of recent additions (a NaN reading marks a removed key)."""
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.recent = {}
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes + len(self.recent) * 100
+
+    def _find(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        return i if i < len(self.keys) and self.keys[i] == key else -1
+
+    def get(self, key):
+        i = self._find(key)
+        if i >= 0:
+            value = self.values[i]
+            return None if np.isnan(value) else float(value)
+        return self.recent.get(key)
+
+    def put(self, key, value):
+        i = self._find(key)
+        if i >= 0:
+            self.values[i] = value
+            return
+        self.recent[key] = value
+        if len(self.recent) > max(MERGE_MIN, len(self.keys) // 8):
+            self.extend(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    def discard(self, key):
+        i = self._find(key)
+        if i >= 0:
+            self.values[i] = np.nan
+        else:
+            self.recent.pop(key, None)
+
+    def extend(self, keys, values):
+        """Merge many keys at once (and the recent dict); for a repeated key the last value wins."""
+        keys = np.concatenate([self.keys, np.fromiter(self.recent.keys(), dtype=np.int64, count=len(self.recent)),
+                               np.asarray(keys, dtype=np.int64)])
+        values = np.concatenate([self.values,
+                                 np.fromiter(self.recent.values(), dtype=np.float64, count=len(self.recent)),
+                                 np.asarray(values, dtype=np.float64)])
+        order = np.argsort(keys, kind="stable")
+        keys, values = keys[order], values[order]
+        last = np.r_[keys[1:] != keys[:-1], True] & ~np.isnan(values)
+        self.keys, self.values, self.recent = keys[last], values[last], {}
+
+
+class ReadingDedup:
+    def __init__(self, days=2):
+        self.days = days
+        self._codes = {}   # meter_id -> 整数编号，用在 key 里
+        self._days = {}    # day -> _DaySet
+        self._today = None
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.conflicts = 0
+
+    def __len__(self):
+        return sum(len(s) for s in self._days.values())
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in list(self._days.values()))
+
+    def _key(self, meter_id, epoch):
+        code = self._codes.setdefault(str(meter_id), len(self._codes))
+        return code * SECONDS_PER_DAY + epoch % SECONDS_PER_DAY
+
+    def _day_set(self, day):
+        """
+        The set of `day`, or None outside the window: the last `days` days up to today
+        (by the local clock, like the stored times) plus tomorrow. Older days are dropped.
+        """
+        today = to_epoch(datetime.now()) // SECONDS_PER_DAY
+        if today != self._today:
+            self._today = today
+            for old in [d for d in self._days if d <= today - self.days]:
+                del self._days[old]
+        if day <= today - self.days or day > today + 1:
+            return None
+        day_set = self._days.get(day)
+        if day_set is None:
+            day_set = self._days[day] = _DaySet()
+        return day_set
+
+    def check_and_add(self, meter_ids, times, readings):
+        """
+        Classify a batch (times in epoch seconds) and remember its NEW readings right
+        away, so a retry arriving before the writer thread stored the first copy is
+        also caught. Returns (status array, previously seen reading per row or NaN).
+        """
+        statuses = np.full(len(times), NEW, dtype=np.int8)
+        previous = np.full(len(times), np.nan)
+        with self._lock:
+            for i, (meter_id, epoch, reading) in enumerate(zip(meter_ids, times, readings)):
+                epoch, reading = int(epoch), float(reading)
+                day_set = self._day_set(epoch // SECONDS_PER_DAY)
+                if day_set is None:
+                    continue
+                key = self._key(meter_id, epoch)
+                seen = day_set.get(key)
+                if seen is None:
+                    day_set.put(key, reading)
+                elif seen == reading:
+                    statuses[i], previous[i] = DUPLICATE, seen
+                else:
+                    statuses[i], previous[i] = CONFLICT, seen
+            self.duplicates += int((statuses == DUPLICATE).sum())
+            self.conflicts += int((statuses == CONFLICT).sum())
+        return statuses, previous
+
+    def record(self, duplicates, conflicts):
+        """Count readings that were found already stored when they were written (by another worker)."""
+        with self._lock:
+            self.duplicates += duplicates
+            self.conflicts += conflicts
+
+    def rollback(self, meter_ids, times):
+        """Forget readings that check_and_add() accepted but that were not stored (e.g. the queue was full)."""
+        with self._lock:
+            for meter_id, epoch in zip(meter_ids, times):
+                day_set = self._days.get(int(epoch) // SECONDS_PER_DAY)
+                if day_set is not None:
+                    day_set.discard(self._key(meter_id, int(epoch)))
+
+    def add(self, meter_ids, times, readings):
+        """Remember readings that are already stored (startup, or written by another worker)."""
+        times = np.asarray(times, dtype=np.int64)
+        if len(times) == 0:
+            return
+        with self._lock:
+            if len(times) < MERGE_MIN:
+                for meter_id, epoch, reading in zip(meter_ids, times, readings):
+                    day_set = self._day_set(int(epoch) // SECONDS_PER_DAY)
+                    if day_set is not None:
+                        day_set.put(self._key(meter_id, int(epoch)), float(reading))
+                return
+            # 大批量（启动时）：按天一次性合并
+            codes = np.fromiter((self._codes.setdefault(str(m), len(self._codes)) for m in meter_ids),
+                                dtype=np.int64, count=len(times))
+            keys = codes * SECONDS_PER_DAY + times % SECONDS_PER_DAY
+            days = times // SECONDS_PER_DAY
+            readings = np.asarray(readings, dtype=np.float64)
+            for day in np.unique(days):
+                day_set = self._day_set(int(day))
+                if day_set is not None:
+                    mask = days == day
+                    day_set.extend(keys[mask], readings[mask])
+
+
+class IdempotencyCache:
+    """
+    Thread-safe LRU of (route, Idempotency-Key) -> (request fingerprint, status code, response body),
+    limited by entry count and by the total size of the bodies (a batch reply has one result per reading).
+    """
+
+    ENTRY_OVERHEAD = 200   # key、指纹和 tuple 大约占用的字节
+
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def lookup(self, key, fingerprint):
+        """(status, body) of the first response; None if the key is new, False if it came with another request."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            if item[0] != fingerprint:
+                return False
+            self.replays += 1
+            return item[1], item[2]
+
+    def put(self, key, fingerprint, status, body):
+        size = len(body) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return   # 太大的响应不缓存，重发时重新处理（读数仍会被去重）
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[2]) + self.ENTRY_OVERHEAD
+            self._items[key] = (fingerprint, status, body)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._items.popitem(last=False)
+                self._bytes -= len(evicted) + self.ENTRY_OVERHEAD
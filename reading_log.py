@@ -0,0 +1,164 @@
+"""
+Append-only write-ahead log of meter readings, kept in local_db.csv.
+
+Each batch of readings is written as one contiguous block of complete CSV lines,
+then flushed and fsync'ed according to the configured policy, so the cost of an
+insert no longer depends on the size of the file. On startup the log is replayed
+into the in-memory store; a half-written last line left by a crash is dropped.
+"""
+import csv
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from reading_store import TIME_FORMAT, epoch_seconds
+
+LOG_COLUMNS = ["meter_id", "time", "reading"]
+FSYNC_POLICIES = ("batch", "interval", "none")
+
+
+def format_times(epochs):
+    """int64 epoch seconds -> 'YYYY-mm-dd HH:MM:SS' strings."""
+    stamps = np.datetime_as_string(np.asarray(epochs, dtype=np.int64).astype('datetime64[s]'), unit='s')
+    return [s.replace('T', ' ') for s in stamps]
+
+
+def format_reading(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def format_lines(meter_ids, times, readings):
+    """CSV lines meter_id,time,reading (csv.writer: a meter_id containing a comma or quote is quoted)."""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(
+        (m, t, format_reading(r)) for m, t, r in zip(meter_ids, format_times(times), readings))
+    return buffer.getvalue()
+
+
+class ReadingLog:
+    def __init__(self, path, fsync="batch", fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+
+        self._repair_tail()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        if is_new:
+            self._file.write(",".join(LOG_COLUMNS) + "\n")
+            self._file.flush()
+
+    def _repair_tail(self):
+        """Truncate an incomplete last line (crash in the middle of an append)."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                idx = chunk.rfind(b"\n")
+                if idx >= 0:
+                    f.truncate(pos + idx + 1)
+                    print(f"Dropped {size - (pos + idx + 1)} bytes of torn data at the end of {self.path}")
+                    return
+            f.truncate(0)
+
+    def append_batch(self, meter_ids, times, readings):
+        """Append one batch. `times` are int64 epoch seconds."""
+        lines = format_lines(meter_ids, times, readings)
+        if not lines:
+            return
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            now = time.monotonic()
+            if self.fsync == "batch" or (self.fsync == "interval" and now - self._last_sync >= self.fsync_interval):
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    def sync(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    def replay(self, store, since=None, chunksize=100_000):
+        """
+        Load the readings with time >= `since` (epoch seconds; None: all) into `store`
+        (a ReadingStore). Returns the number of rows in the log (the last reading id),
+        counting the malformed rows that are skipped: a reading's id is its row number,
+        the same before and after a restart.
+        """
+        self._file.flush()
+        # 格式错误的行跳过（打印警告），不让一行坏数据阻止启动；但它们仍占一个 id
+        for chunk in pd.read_csv(self.path, dtype={"meter_id": str}, chunksize=chunksize, on_bad_lines="warn"):
+            times = pd.to_datetime(chunk["time"], format=TIME_FORMAT, errors="coerce")
+            readings = pd.to_numeric(chunk["reading"], errors="coerce")
+            ok = (times.notna() & readings.notna()).to_numpy()
+            epochs = times[ok].to_numpy("datetime64[s]").astype(np.int64)
+            keep = epochs >= since if since is not None else slice(None)
+            store.extend(chunk["meter_id"].to_numpy()[ok][keep], epochs[keep], readings[ok].to_numpy()[keep])
+        return count_rows(self.path)
+
+
+def count_rows(path, block=1 << 20):
+    """Number of data lines in the log (every line ends with a newline; the first one is the header)."""
+    lines = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            lines += data.count(b"\n")
+    return max(lines - 1, 0)
+
+
+def iter_log(path, chunk_bytes=4 << 20):
+    """
+    Read the log in blocks of about `chunk_bytes` (export: memory does not grow with
+    the file). Only the complete lines present when the call starts are read.
+    Yields (meter_ids, epoch times, readings) per block; unparsable rows are skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+        f.readline()   # 表头
+        rest = b""
+        while f.tell() < end:
+            block = rest + f.read(min(chunk_bytes, end - f.tell()))
+            cut = block.rfind(b"\n") + 1
+            block, rest = block[:cut], block[cut:]
+            if not block:
+                continue
+            chunk = pd.read_csv(io.BytesIO(block), header=None, names=LOG_COLUMNS, dtype={"meter_id": str},
+                                on_bad_lines="warn")
+            times, valid = epoch_seconds(chunk["time"])
+            readings = pd.to_numeric(chunk["reading"], errors="coerce").to_numpy(dtype=np.float64)
+            valid &= ~np.isnan(readings) & chunk["meter_id"].notna().to_numpy()
+            yield chunk["meter_id"].to_numpy(dtype=object)[valid], times[valid], readings[valid]
@@ -0,0 +1,111 @@
+"""
+Time helpers shared by every module, and ReadingStore, the buffer that collects
+readings while they are loaded.
+
+ReadingStore is filled by Repository.load_readings() at startup (the recent
+readings that seed intraday and the duplicate check) and when the CSV log is
+imported into SQLite; it is thrown away afterwards -- queries never read it.
+Readings are kept in three preallocated NumPy columns (interned meter_id codes,
+int64 epoch seconds, float64 readings) that grow by doubling, so loading a log
+chunk by chunk is amortized O(1) per row instead of a pd.concat per chunk.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 所有模块共用的时间约定：CSV 里的时间格式，以及 epoch 秒 // SECONDS_PER_DAY 得到日期编号
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SECONDS_PER_DAY = 86400
+
+
+def to_epoch(value):
+    """Convert a datetime / datetime64 / 'YYYY-mm-dd HH:MM:SS' string to int64 epoch seconds."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.strptime(value, TIME_FORMAT)
+    return int(np.datetime64(value, 's').astype(np.int64))
+
+
+def today_start_epoch(now=None):
+    """Epoch seconds of today's (or `now`'s) midnight, local clock like the stored times."""
+    now = now or datetime.now()
+    return to_epoch(now.replace(hour=0, minute=0, second=0, microsecond=0))
+
+
+def epoch_seconds(values):
+    """Parse a time column once: (int64 epoch seconds, valid mask). Integer columns are epoch seconds already."""
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values):
+        times = values.to_numpy(dtype=np.int64)
+        return times, np.ones(len(times), dtype=bool)
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, format=TIME_FORMAT, errors='coerce')
+    stamps = values.to_numpy('datetime64[s]')
+    return stamps.astype(np.int64), ~np.isnat(stamps)
+
+
+class ReadingStore:
+    """
+    Growable columnar buffer of (meter_id, time, reading), used by one thread while
+    loading; since() returns the rows from a given time on.
+    """
+
+    def __init__(self, capacity=1024):
+        self._codes = np.empty(capacity, dtype=np.int32)
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._readings = np.empty(capacity, dtype=np.float64)
+        self._size = 0
+        self._meter_codes = {}   # meter_id -> code
+        self._meter_ids = []     # code -> meter_id
+
+    def __len__(self):
+        return self._size
+
+    def intern(self, meter_id):
+        """Return the integer code of a meter_id, assigning a new one if needed."""
+        meter_id = str(meter_id)
+        code = self._meter_codes.get(meter_id)
+        if code is None:
+            code = len(self._meter_ids)
+            self._meter_ids.append(meter_id)
+            self._meter_codes[meter_id] = code
+        return code
+
+    def _reserve(self, n):
+        need = self._size + n
+        capacity = len(self._codes)
+        if need <= capacity:
+            return
+        new_capacity = max(need, capacity * 2)
+        for name in ('_codes', '_times', '_readings'):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def extend(self, meter_ids, times, readings):
+        """Append many rows at once. `times` must already be epoch seconds (int64)."""
+        codes = np.fromiter((self.intern(m) for m in meter_ids), dtype=np.int32)
+        n = len(codes)
+        if n == 0:
+            return
+        self._reserve(n)
+        start = self._size
+        self._codes[start:start + n] = codes
+        self._times[start:start + n] = np.asarray(times, dtype=np.int64)
+        self._readings[start:start + n] = np.asarray(readings, dtype=np.float64)
+        self._size = start + n
+
+    def columns(self):
+        """Zero-copy (codes, times, readings) views of the rows written so far."""
+        size = self._size
+        return self._codes[:size], self._times[:size], self._readings[:size]
+
+    def since(self, epoch):
+        """(meter_ids, times, readings) of the rows with time >= epoch."""
+        codes, times, readings = self.columns()
+        mask = times >= epoch
+        meter_ids = np.asarray(self._meter_ids, dtype=object)
+        return meter_ids[codes[mask]], times[mask], readings[mask]
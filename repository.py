@@ -0,0 +1,829 @@
+"""
+Storage of users, raw readings and daily rollups behind one interface.
+
+    csv     users.csv, local_db.csv (append-only log), daily_usage.csv and the
+            month-partitioned .npy history -- one server process (python app4.py)
+    sqlite  one SQLite database in WAL mode with indexed tables, shared by several
+            worker processes (gunicorn)
+
+The backend is chosen with ELEC_STATE_BACKEND (see open_repository()).
+
+The app keeps the recent readings (intraday, duplicate check) in memory and
+pulls new rows with readings_after(last_id): every appended reading gets an
+increasing id (its row number in local_db.csv, or the SQLite primary key), so a
+worker also sees the readings written by the other workers.
+"""
+import io
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+import config
+from group_usage import GROUP_USAGE_COLUMNS
+from history_store import DailyHistory
+from reading_log import ReadingLog, format_reading, format_times, iter_log
+from reading_store import SECONDS_PER_DAY, ReadingStore, epoch_seconds
+from user_index import UserIndex
+from user_persister import UserPersister
+from user_table import USER_COLUMNS, UserRecord, append_users, compact, memory_bytes, read_users_csv
+
+READING_COLUMNS = ["meter_id", "time", "reading"]
+
+
+def _empty_readings():
+    return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+
+class Repository(ABC):
+    """Interface shared by the CSV and SQLite backends (every abstract method must be implemented)."""
+
+    name = "repository"
+    shared = False   # True if other processes may write to the same storage
+
+    @abstractmethod
+    def open(self):
+        """Prepare the storage (load / import / build indexes). Safe to call more than once."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self):
+        raise NotImplementedError
+
+    def flush(self):
+        """Write out anything buffered in memory."""
+
+    # ---------- users ----------
+    @abstractmethod
+    def add_user(self, record):
+        """Register a user (dict with USER_COLUMNS). Returns False if the meter_id is taken."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_users(self, records):
+        """Register many users in one write (DataFrame with USER_COLUMNS). Boolean array: which were added."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def has_user(self, meter_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def has_users(self, meter_ids):
+        """Boolean array: which of `meter_ids` are registered."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user(self, meter_id):
+        """The user's record (user_table.UserRecord), or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def users_frame(self):
+        """All users as a DataFrame with USER_COLUMNS, in the compact layout of user_table.compact()."""
+        raise NotImplementedError
+
+    # ---------- readings ----------
+    @abstractmethod
+    def append_readings(self, meter_ids, times, readings):
+        """
+        Store a batch (times in epoch seconds) and update the users' latest reading.
+        Returns, per row, the reading that was already stored for the same meter and
+        time (the row was not stored again), or NaN for the rows that were stored.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_readings(self, store, since=None):
+        """
+        Load the readings with time >= `since` (epoch seconds; None: every reading)
+        into a ReadingStore; returns the id of the last reading.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def readings_after(self, last_id):
+        """(meter_ids, times, readings, new last_id) of the readings appended after `last_id`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def new_readings(self, watermark):
+        """(DataFrame meter_id/time/reading, new watermark) of readings not rolled up yet."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def readings_end(self):
+        """Watermark of the end of the readings (a watermark above it means the data was replaced)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_readings(self, start, end, meter_ids=None, chunk_rows=50_000):
+        """
+        Raw readings with start <= time <= end (epoch seconds), only of `meter_ids` if
+        given, read from the storage in chunks: yields (meter_ids, times, readings).
+        """
+        raise NotImplementedError
+
+    # ---------- daily rollups ----------
+    @abstractmethod
+    def merge_daily(self, meter_ids, times, readings, replace=False):
+        """Store the last reading per meter per day; for the same day the latest time wins."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def has_daily(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def daily_range(self, meter_id, start, end):
+        """DataFrame time/reading of one meter with start <= time <= end (epoch seconds), sorted by time."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def daily_version(self):
+        """Timestamp of the last change of the daily rollups (used for cache keys and Last-Modified)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def daily_rows(self, start, end):
+        """(meter_ids, times, readings) of every meter's daily rows with start <= time <= end."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_daily(self, start, end, meter_ids=None, chunk_rows=50_000):
+        """Daily rows with start <= time <= end, in chunks like iter_readings()."""
+        raise NotImplementedError
+
+    # ---------- group rollups (group_usage.py) ----------
+    @abstractmethod
+    def replace_group_usage(self, rows, days=None):
+        """Replace the aggregates of `days` (epoch day numbers; None = all) with `rows` (GROUP_USAGE_COLUMNS)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def group_usage(self, dimension, start_day, end_day, name=None):
+        """DataFrame name/day/total/mean/meters of one dimension, sorted by (name, day)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def group_usage_version(self):
+        """Timestamp of the last change of the group aggregates."""
+        raise NotImplementedError
+
+
+class CsvRepository(Repository):
+    """The original file layout; the users table lives in memory and is written back to users.csv."""
+
+    name = "csv"
+
+    def __init__(self, local_db_file, users_file, daily_usage_file, history_dir, group_usage_file,
+                 fsync="batch", fsync_interval=1.0, flush_interval=5.0, max_dirty=10000):
+        self.local_db_file = local_db_file
+        self.users_file = users_file
+        self.daily_usage_file = daily_usage_file
+        self.history = DailyHistory(history_dir)
+        self.group_usage_file = group_usage_file
+        self._groups = None   # group_usage.csv 在内存中的副本，整体替换，读者不加锁
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._log = None
+        self._users = None
+        self._user_index = UserIndex()
+        # 写线程更新 reading 与注册追加新用户都会修改 users，用锁保证互斥
+        self._users_lock = threading.Lock()
+        self._persister = UserPersister(users_file, lambda: self._users, self._users_lock,
+                                        interval=flush_interval, max_dirty=max_dirty)
+        self._readings_lock = threading.Lock()
+        self._last_id = 0
+        self._pending = []   # 已写入日志、还没被 readings_after() 取走的批次
+        self._open_lock = threading.Lock()
+        self._opened = False
+
+    def open(self):
+        with self._open_lock:
+            if self._opened:
+                return
+            self._users = self.load_users_csv()
+            self._user_index.rebuild(self._users)
+            print(f"Loaded {len(self._users)} users ({memory_bytes(self._users).sum() / 1024:.1f} KB in memory)")
+            self._persister.start()
+            self._build_history()
+            self._opened = True
+
+    def close(self):
+        self._persister.stop()
+        if self._log is not None:
+            self._log.close()
+
+    def flush(self):
+        self._persister.flush()
+
+    # ---------- users ----------
+    def load_users_csv(self):
+        # 紧凑格式：枚举字段用 category，time 用 datetime64，见 user_table.py
+        if os.path.exists(self.users_file):
+            return compact(read_users_csv(self.users_file))
+        return compact(pd.DataFrame(columns=USER_COLUMNS))
+
+    def add_user(self, record):
+        row = pd.DataFrame([record], columns=USER_COLUMNS)
+        with self._users_lock:
+            if record["meter_id"] in self._user_index:
+                return False
+            self._users = append_users(self._users, row)
+            position = len(self._users) - 1
+            self._user_index.add(record["meter_id"], position)
+        self._persister.mark_dirty([position])   # 稍后合并写入 users.csv
+        return True
+
+    def add_users(self, records):
+        rows = records.reindex(columns=USER_COLUMNS).reset_index(drop=True)
+        with self._users_lock:
+            # 校验和写入之间可能已有同一电表注册；文件内重复的只保留第一条
+            added = ~self._user_index.contains_many(rows["meter_id"]) & ~rows["meter_id"].duplicated().to_numpy()
+            rows = rows[added]
+            start = len(self._users)
+            if len(rows):
+                self._users = append_users(self._users, rows)
+                self._user_index.add_many(rows["meter_id"], start)
+        # 一次标记全部新行：users.csv 只重写一次
+        self._persister.mark_dirty(range(start, start + len(rows)))
+        return added
+
+    def has_user(self, meter_id):
+        return meter_id in self._user_index
+
+    def has_users(self, meter_ids):
+        return self._user_index.contains_many(meter_ids)
+
+    def get_user(self, meter_id):
+        position = self._user_index.get(meter_id)
+        if position is None:
+            return None
+        return UserRecord.from_frame(self._users, position)
+
+    def users_frame(self):
+        return self._users
+
+    # ---------- readings ----------
+    def _reading_log(self):
+        if self._log is None:
+            self._log = ReadingLog(self.local_db_file, fsync=self.fsync, fsync_interval=self.fsync_interval)
+        return self._log
+
+    def append_readings(self, meter_ids, times, readings):
+        meter_ids = np.asarray(meter_ids, dtype=object)
+        times = np.asarray(times, dtype=np.int64)
+        readings = np.asarray(readings, dtype=np.float64)
+        # 先追加到 local_db.csv 日志（只追加新行，不再读整个文件）
+        self._reading_log().append_batch(meter_ids, times, readings)
+        # 写进日志后马上登记，后面更新 users 出错也不会漏掉这批读数
+        with self._readings_lock:
+            self._last_id += len(times)
+            self._pending.append((self._last_id, meter_ids, times, readings))
+
+        # 更新 users 里的 reading 值（每个电表取本批最后一条，通过索引直接定位行）
+        latest = pd.DataFrame({"meter_id": meter_ids, "reading": readings}).drop_duplicates("meter_id", keep="last")
+        positions = self._user_index.positions(latest["meter_id"])
+        found = positions >= 0
+        with self._users_lock:
+            self._users.iloc[positions[found], self._users.columns.get_loc("reading")] = latest["reading"].to_numpy()[found]
+        # 标记改动的行，由 persister 合并写入 users.csv
+        self._persister.mark_dirty(positions[found])
+        # 单进程：重复的读数在请求里已经被 ReadingDedup 拦下
+        return np.full(len(times), np.nan)
+
+    def load_readings(self, store, since=None):
+        loaded = self._reading_log().replay(store, since)
+        with self._readings_lock:
+            self._last_id = loaded
+            self._pending = []
+        return loaded
+
+    def readings_after(self, last_id):
+        with self._readings_lock:
+            batches = [b for b in self._pending if b[0] > last_id]
+            self._pending = []
+        if not batches:
+            return (*_empty_readings(), last_id)
+        return (np.concatenate([b[1] for b in batches]), np.concatenate([b[2] for b in batches]),
+                np.concatenate([b[3] for b in batches]), batches[-1][0])
+
+    def new_readings(self, watermark):
+        """Readings after byte offset `watermark` of local_db.csv; only complete lines are consumed."""
+        if not os.path.exists(self.local_db_file):
+            return pd.DataFrame(columns=READING_COLUMNS), 0
+
+        with open(self.local_db_file, 'rb') as f:
+            f.seek(watermark)
+            raw = f.read()
+        end = raw.rfind(b'\n') + 1
+        raw = raw[:end]
+        if not raw.strip():
+            return pd.DataFrame(columns=READING_COLUMNS), watermark + end
+
+        if watermark == 0:
+            new_readings = pd.read_csv(io.BytesIO(raw), dtype={'meter_id': str}, on_bad_lines="warn")
+        else:
+            new_readings = pd.read_csv(io.BytesIO(raw), header=None, names=READING_COLUMNS, dtype={'meter_id': str},
+                                       on_bad_lines="warn")
+
+        # time 列在这里解析一次，转成 int64 epoch 秒
+        times, valid = epoch_seconds(new_readings["time"])
+        new_readings["time"] = times
+        return new_readings[valid].reset_index(drop=True), watermark + end
+
+    def readings_end(self):
+        return os.path.getsize(self.local_db_file) if os.path.exists(self.local_db_file) else 0
+
+    def iter_readings(self, start, end, meter_ids=None, chunk_rows=50_000):
+        # 直接分块读取 local_db.csv（每行约 40 字节），不经过内存中的 data_store
+        wanted = None if meter_ids is None else np.asarray(list(meter_ids), dtype=object)
+        for ids, times, readings in iter_log(self.local_db_file, chunk_bytes=chunk_rows * 40):
+            keep = (times >= start) & (times <= end)
+            if wanted is not None:
+                keep &= np.isin(ids, wanted)
+            if keep.any():
+                yield ids[keep], times[keep], readings[keep]
+
+    # ---------- daily rollups ----------
+    def load_daily_csv(self):
+        """(meter_ids, epoch times, readings) of daily_usage.csv."""
+        if not os.path.exists(self.daily_usage_file):
+            return _empty_readings()
+        daily = pd.read_csv(self.daily_usage_file, dtype={'meter_id': str}, on_bad_lines="warn")
+        times, valid = epoch_seconds(daily["time"])
+        valid &= daily["reading"].notna().to_numpy()
+        return (daily["meter_id"].to_numpy()[valid], times[valid],
+                daily["reading"].to_numpy(dtype=np.float64)[valid])
+
+    def _build_history(self):
+        # 第一次启动时由 daily_usage.csv 生成分区历史（加锁：几个进程同时启动时只有一个生成）
+        with self.history.write_lock():
+            if not self.history.exists():
+                meter_ids, times, readings = self.load_daily_csv()
+                if len(times):
+                    self.history.merge(meter_ids, times, readings)
+                    print(f"Built partitioned history from {len(times)} rows of daily_usage.csv")
+        print(f"Memory-mapped {self.history.open_all()} history partitions")
+
+    def merge_daily(self, meter_ids, times, readings, replace=False):
+        # 分区历史：重建时整体替换 manifest，读者在此之前一直使用旧分区
+        self.history.merge(meter_ids, times, readings, replace=replace)
+
+        rows = pd.DataFrame({'meter_id': meter_ids,
+                             'time': format_times(times),
+                             'reading': [format_reading(r) for r in readings]})
+        if replace or not os.path.exists(self.daily_usage_file):
+            rows.to_csv(self.daily_usage_file, index=False)
+        else:
+            rows.to_csv(self.daily_usage_file, mode='a', header=False, index=False)
+
+    def has_daily(self):
+        return self.history.exists()
+
+    def daily_range(self, meter_id, start, end):
+        return self.history.load_range(meter_id, start, end)
+
+    def daily_version(self):
+        return self.history.version
+
+    def daily_rows(self, start, end):
+        return self.history.load_days(start, end)
+
+    def iter_daily(self, start, end, meter_ids=None, chunk_rows=50_000):
+        return self.history.iter_days(start, end, meter_ids, chunk_rows)
+
+    # ---------- group rollups ----------
+    def _load_groups(self):
+        if self._groups is None:
+            if os.path.exists(self.group_usage_file):
+                frame = pd.read_csv(self.group_usage_file, dtype={"name": str})
+                frame["day"] = pd.to_datetime(frame.pop("date")).to_numpy("datetime64[D]").astype(np.int64)
+                self._groups = frame[GROUP_USAGE_COLUMNS]
+            else:
+                self._groups = pd.DataFrame(columns=GROUP_USAGE_COLUMNS)
+        return self._groups
+
+    def replace_group_usage(self, rows, days=None):
+        frame = self._load_groups()
+        if days is not None and not frame.empty:
+            rows = pd.concat([frame[~frame["day"].isin(days)], rows], ignore_index=True)
+        frame = rows.sort_values(["dimension", "name", "day"], ignore_index=True)
+
+        # 文件里用日期字符串，先写临时文件再 os.replace，保证原子性
+        output = frame.drop(columns="day")
+        output.insert(2, "date", frame["day"].to_numpy(dtype=np.int64).astype("datetime64[D]").astype(str))
+        tmp_path = self.group_usage_file + ".tmp"
+        output.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.group_usage_file)
+        self._groups = frame
+
+    def group_usage(self, dimension, start_day, end_day, name=None):
+        frame = self._load_groups()
+        mask = (frame["dimension"] == dimension) & (frame["day"] >= start_day) & (frame["day"] <= end_day)
+        if name is not None:
+            mask &= frame["name"] == name
+        return frame.loc[mask, GROUP_USAGE_COLUMNS[1:]].reset_index(drop=True)
+
+    def group_usage_version(self):
+        return os.path.getmtime(self.group_usage_file) if os.path.exists(self.group_usage_file) else None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT, meter_id TEXT NOT NULL UNIQUE, dwelling_type TEXT, region TEXT,
+    area TEXT, community TEXT, unit TEXT, floor TEXT, email TEXT, tel TEXT,
+    reading REAL, time TEXT
+);
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    meter_id TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    reading REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS readings_meter_time ON readings (meter_id, time);
+CREATE TABLE IF NOT EXISTS daily (
+    meter_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    reading REAL NOT NULL,
+    PRIMARY KEY (meter_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_day ON daily (day);
+CREATE TABLE IF NOT EXISTS group_daily (
+    dimension TEXT NOT NULL,
+    name TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    total REAL NOT NULL,
+    mean REAL NOT NULL,
+    meters INTEGER NOT NULL,
+    PRIMARY KEY (dimension, name, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS group_daily_day ON group_daily (day);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+INSERT_USER = f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})"
+INSERT_USER_IGNORE = INSERT_USER + " ON CONFLICT (meter_id) DO NOTHING"
+SELECT_USER = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE meter_id = ?"
+INSERT_READING = "INSERT INTO readings (meter_id, time, reading) VALUES (?, ?, ?)"
+INSERT_READING_IGNORE = INSERT_READING + " ON CONFLICT (meter_id, time) DO NOTHING"
+SELECT_READING = "SELECT reading FROM readings WHERE meter_id = ? AND time = ?"
+UPDATE_USER_READING = "UPDATE users SET reading = ? WHERE meter_id = ?"
+SELECT_READINGS_AFTER = "SELECT id, meter_id, time, reading FROM readings WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_READINGS_SINCE = """
+SELECT id, meter_id, time, reading FROM readings
+WHERE id > ? AND id <= ? AND time >= ?
+ORDER BY id LIMIT ?
+"""
+SELECT_READINGS_RANGE = "SELECT meter_id, time, reading FROM readings WHERE time BETWEEN ? AND ? ORDER BY id"
+SELECT_METER_READINGS_RANGE = """
+SELECT meter_id, time, reading FROM readings
+WHERE meter_id = ? AND time BETWEEN ? AND ?
+ORDER BY time
+"""
+UPSERT_DAILY = """
+INSERT INTO daily (meter_id, day, time, reading) VALUES (?, ?, ?, ?)
+ON CONFLICT (meter_id, day) DO UPDATE SET time = excluded.time, reading = excluded.reading
+WHERE excluded.time >= daily.time
+"""
+SELECT_DAILY_RANGE = """
+SELECT time, reading FROM daily
+WHERE meter_id = ? AND day BETWEEN ? AND ? AND time BETWEEN ? AND ?
+ORDER BY day
+"""
+SELECT_METER_DAILY_RANGE = """
+SELECT meter_id, time, reading FROM daily
+WHERE meter_id = ? AND day BETWEEN ? AND ? AND time BETWEEN ? AND ?
+ORDER BY day
+"""
+SELECT_DAILY_ROWS = "SELECT meter_id, time, reading FROM daily WHERE day BETWEEN ? AND ? AND time BETWEEN ? AND ?"
+INSERT_GROUP = "INSERT INTO group_daily (dimension, name, day, total, mean, meters) VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_GROUP = "SELECT name, day, total, mean, meters FROM group_daily WHERE dimension = ? AND day BETWEEN ? AND ?"
+TOUCH_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+
+
+def _user_values(record):
+    values = []
+    for column in USER_COLUMNS:
+        value = record.get(column)
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            values.append(None)
+        elif column == "reading":
+            values.append(float(value))
+        else:
+            values.append(str(value))
+    return values
+
+
+class SqliteRepository(Repository):
+    """
+    One SQLite database in WAL mode: any number of workers read while one writes.
+    Every lookup goes through an index (users.meter_id UNIQUE, readings(meter_id, time),
+    daily PRIMARY KEY (meter_id, day)); batches are inserted with executemany in one
+    transaction, and the constant SQL strings are compiled once per connection
+    (sqlite3's statement cache).
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path, csv=None, timeout=30.0, chunk_rows=100_000):
+        self.path = path
+        self.csv = csv   # 第一次启动时从这些 CSV 文件导入
+        self.timeout = timeout
+        self.chunk_rows = chunk_rows
+        self._local = threading.local()
+        self._opened = False
+
+    # ---------- connections ----------
+    def connect(self):
+        """One connection per thread (sqlite3 connections must not be shared between threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in one write transaction (BEGIN IMMEDIATE: writers from all processes queue up)."""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def open(self):
+        if self._opened:
+            return
+        self.connect().executescript(SQLITE_SCHEMA)
+        self._write(self._unique_readings)
+        imported = self._write(self._import_csv)
+        if any(imported):
+            print(f"Imported {imported[0]} users, {imported[1]} readings and {imported[2]} daily rows into {self.path}")
+        self._opened = True
+
+    @staticmethod
+    def _unique_readings(conn):
+        """Databases created before (meter_id, time) was unique: drop the repeated rows (keep the first) and rebuild the index."""
+        unique = {row[1]: row[2] for row in conn.execute("PRAGMA index_list(readings)")}
+        if unique.get("readings_meter_time"):
+            return
+        removed = conn.execute("DELETE FROM readings WHERE id NOT IN "
+                               "(SELECT MIN(id) FROM readings GROUP BY meter_id, time)").rowcount
+        conn.execute("DROP INDEX IF EXISTS readings_meter_time")
+        conn.execute("CREATE UNIQUE INDEX readings_meter_time ON readings (meter_id, time)")
+        print(f"Made readings (meter_id, time) unique: removed {removed} repeated readings")
+
+    def _import_csv(self, conn):
+        """Fill an empty database from the CSV files (only the first worker to get the write lock does it)."""
+        has_data = conn.execute("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM readings)").fetchone()[0]
+        if has_data or self.csv is None:
+            return 0, 0, 0
+        users = self.csv.load_users_csv()
+        conn.executemany(INSERT_USER, (_user_values(r) for r in users.to_dict("records")))
+        store = ReadingStore()
+        self.csv.load_readings(store)
+        meter_ids, times, readings = store.since(np.iinfo(np.int64).min)
+        conn.executemany(INSERT_READING_IGNORE, zip(map(str, meter_ids), map(int, times), map(float, readings)))
+        daily = self.csv.load_daily_csv()
+        self._upsert_daily(conn, *daily)
+        self.csv.close()
+        return len(users), len(times), len(daily[1])
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---------- users ----------
+    def add_user(self, record):
+        # meter_id 是 UNIQUE，几个 worker 同时注册同一个电表也只有一个成功
+        try:
+            self.connect().execute(INSERT_USER, _user_values(record))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def add_users(self, records):
+        values = [_user_values(r) for r in records.reindex(columns=USER_COLUMNS).to_dict("records")]
+
+        def write(conn):
+            # 一个事务；已注册的 meter_id 跳过（rowcount 为 0），不让整批失败
+            added = np.zeros(len(values), dtype=bool)
+            for i, row in enumerate(values):
+                added[i] = conn.execute(INSERT_USER_IGNORE, row).rowcount == 1
+            return added
+        return self._write(write)
+
+    def has_user(self, meter_id):
+        return self.connect().execute("SELECT 1 FROM users WHERE meter_id = ?", (str(meter_id),)).fetchone() is not None
+
+    def has_users(self, meter_ids):
+        meter_ids = [str(m) for m in meter_ids]
+        found = set()
+        conn = self.connect()
+        for i in range(0, len(meter_ids), 500):
+            chunk = meter_ids[i:i + 500]
+            sql = f"SELECT meter_id FROM users WHERE meter_id IN ({', '.join('?' * len(chunk))})"
+            found.update(row[0] for row in conn.execute(sql, chunk))
+        return np.fromiter((m in found for m in meter_ids), dtype=bool, count=len(meter_ids))
+
+    def get_user(self, meter_id):
+        row = self.connect().execute(SELECT_USER, (str(meter_id),)).fetchone()
+        return UserRecord(**dict(zip(USER_COLUMNS, row))) if row is not None else None
+
+    def users_frame(self):
+        rows = self.connect().execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY id").fetchall()
+        return compact(pd.DataFrame(rows, columns=USER_COLUMNS))
+
+    # ---------- readings ----------
+    def append_readings(self, meter_ids, times, readings):
+        rows = list(zip(map(str, meter_ids), map(int, times), map(float, readings)))
+        previous = np.full(len(rows), np.nan)
+        if not rows:
+            return previous
+
+        def write(conn):
+            # (meter_id, time) 是 UNIQUE：另一个 worker 已写入的同一读数不再写入（每个进程的 ReadingDedup 只看得到本进程）
+            conn.execute("SAVEPOINT batch")
+            stored = np.ones(len(rows), dtype=bool)
+            if conn.executemany(INSERT_READING_IGNORE, rows).rowcount < len(rows):
+                # 有行被跳过：撤销后逐行写入，找出是哪些行以及已有的读数
+                conn.execute("ROLLBACK TO batch")
+                for i, row in enumerate(rows):
+                    if conn.execute(INSERT_READING_IGNORE, row).rowcount == 0:
+                        stored[i] = False
+                        previous[i] = conn.execute(SELECT_READING, row[:2]).fetchone()[0]
+            conn.execute("RELEASE batch")
+            # 每个电表本批最后一条写入的读数
+            latest = {row[0]: row[2] for row, ok in zip(rows, stored) if ok}
+            conn.executemany(UPDATE_USER_READING, ((r, m) for m, r in latest.items()))
+        self._write(write)
+        return previous
+
+    def _fetch_after(self, last_id, limit):
+        rows = self.connect().execute(SELECT_READINGS_AFTER, (last_id, limit)).fetchall()
+        if not rows:
+            return (*_empty_readings(), last_id)
+        ids, meter_ids, times, readings = zip(*rows)
+        return (np.array(meter_ids, dtype=object), np.array(times, dtype=np.int64),
+                np.array(readings, dtype=np.float64), ids[-1])
+
+    def load_readings(self, store, since=None):
+        end = self.readings_end()
+        since = np.iinfo(np.int64).min if since is None else int(since)
+        conn = self.connect()
+        last_id = 0
+        while True:
+            rows = conn.execute(SELECT_READINGS_SINCE, (last_id, end, since, self.chunk_rows)).fetchall()
+            if not rows:
+                return end
+            ids, meter_ids, times, readings = zip(*rows)
+            store.extend(np.array(meter_ids, dtype=object), np.array(times, dtype=np.int64),
+                         np.array(readings, dtype=np.float64))
+            last_id = ids[-1]
+
+    def readings_after(self, last_id):
+        return self._fetch_after(last_id, -1)   # LIMIT -1：不限制
+
+    def new_readings(self, watermark):
+        """Readings with id > `watermark` (the last rolled-up readings.id)."""
+        meter_ids, times, readings, last_id = self.readings_after(watermark)
+        return pd.DataFrame({"meter_id": meter_ids, "time": times, "reading": readings}), last_id
+
+    def readings_end(self):
+        return self.connect().execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0]
+
+    def _iter_query(self, queries, chunk_rows):
+        """
+        Run (sql, params) queries on a connection of their own and yield the rows in
+        chunks of `chunk_rows` (fetchmany: SQLite steps through the index, nothing is
+        sorted or buffered). The connection is closed when the generator finishes or is closed.
+        """
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=self.timeout,
+                               check_same_thread=False)
+        try:
+            for sql, params in queries:
+                cursor = conn.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    meter_ids, times, readings = zip(*rows)
+                    yield (np.array(meter_ids, dtype=object), np.array(times, dtype=np.int64),
+                           np.array(readings, dtype=np.float64))
+        finally:
+            conn.close()
+
+    def iter_readings(self, start, end, meter_ids=None, chunk_rows=50_000):
+        if meter_ids is None:
+            queries = [(SELECT_READINGS_RANGE, (start, end))]
+        else:
+            # 每个电表走 readings(meter_id, time) 索引
+            queries = [(SELECT_METER_READINGS_RANGE, (str(m), start, end)) for m in dict.fromkeys(meter_ids)]
+        return self._iter_query(queries, chunk_rows)
+
+    # ---------- daily rollups ----------
+    @staticmethod
+    def _upsert_daily(conn, meter_ids, times, readings):
+        times = np.asarray(times, dtype=np.int64)
+        conn.executemany(UPSERT_DAILY, zip(map(str, meter_ids), map(int, times // SECONDS_PER_DAY),
+                                           map(int, times), map(float, readings)))
+        conn.execute(TOUCH_META, ("daily_version", time.time()))
+
+    def merge_daily(self, meter_ids, times, readings, replace=False):
+        def write(conn):
+            if replace:
+                conn.execute("DELETE FROM daily")
+            self._upsert_daily(conn, meter_ids, times, readings)
+        self._write(write)
+
+    def has_daily(self):
+        return self.connect().execute("SELECT EXISTS (SELECT 1 FROM daily)").fetchone()[0] == 1
+
+    def daily_range(self, meter_id, start, end):
+        rows = self.connect().execute(SELECT_DAILY_RANGE,
+                                      (str(meter_id), start // SECONDS_PER_DAY, end // SECONDS_PER_DAY, start, end)).fetchall()
+        times = np.array([r[0] for r in rows], dtype=np.int64)
+        readings = np.array([r[1] for r in rows], dtype=np.float64)
+        return pd.DataFrame({"time": times.astype('datetime64[s]'), "reading": readings})
+
+    def daily_version(self):
+        return self._meta("daily_version")
+
+    def _meta(self, key):
+        row = self.connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def daily_rows(self, start, end):
+        rows = self.connect().execute(SELECT_DAILY_ROWS, (start // SECONDS_PER_DAY, end // SECONDS_PER_DAY, start, end)).fetchall()
+        if not rows:
+            return _empty_readings()
+        meter_ids, times, readings = zip(*rows)
+        return (np.array(meter_ids, dtype=object), np.array(times, dtype=np.int64),
+                np.array(readings, dtype=np.float64))
+
+    def iter_daily(self, start, end, meter_ids=None, chunk_rows=50_000):
+        days = (start // SECONDS_PER_DAY, end // SECONDS_PER_DAY, start, end)
+        if meter_ids is None:
+            queries = [(SELECT_DAILY_ROWS, days)]
+        else:
+            queries = [(SELECT_METER_DAILY_RANGE, (str(m), *days)) for m in dict.fromkeys(meter_ids)]
+        return self._iter_query(queries, chunk_rows)
+
+    # ---------- group rollups ----------
+    def replace_group_usage(self, rows, days=None):
+        values = list(zip(rows["dimension"].astype(str), rows["name"].astype(str), map(int, rows["day"]),
+                          map(float, rows["total"]), map(float, rows["mean"]), map(int, rows["meters"])))
+
+        def write(conn):
+            if days is None:
+                conn.execute("DELETE FROM group_daily")
+            else:
+                conn.executemany("DELETE FROM group_daily WHERE day = ?", ((int(d),) for d in days))
+            conn.executemany(INSERT_GROUP, values)
+            conn.execute(TOUCH_META, ("group_version", time.time()))
+        self._write(write)
+
+    def group_usage(self, dimension, start_day, end_day, name=None):
+        sql, params = SELECT_GROUP, [dimension, int(start_day), int(end_day)]
+        if name is not None:
+            sql, params = sql + " AND name = ?", params + [name]
+        rows = self.connect().execute(sql + " ORDER BY name, day", params).fetchall()
+        return pd.DataFrame(rows, columns=GROUP_USAGE_COLUMNS[1:])
+
+    def group_usage_version(self):
+        return self._meta("group_version")
+
+
+def open_repository(backend=None):
+    """The repository selected by ELEC_STATE_BACKEND (csv, or sqlite for several workers)."""
+    backend = backend or config.STATE_BACKEND
+    if backend == "memory":   # 旧名称
+        backend = "csv"
+    csv = CsvRepository(config.LOCAL_DB_FILE, config.USERS_CSV_FILE, config.DAILY_USAGE_FILE, config.HISTORY_DIR,
+                        config.GROUP_USAGE_FILE,
+                        fsync=config.WAL_FSYNC, fsync_interval=config.WAL_FSYNC_INTERVAL,
+                        flush_interval=config.USERS_FLUSH_INTERVAL, max_dirty=config.USERS_FLUSH_MAX_DIRTY)
+    if backend == "csv":
+        return csv
+    if backend == "sqlite":
+        return SqliteRepository(config.SQLITE_FILE, csv=csv)
+    raise ValueError(f"Unknown ELEC_STATE_BACKEND {backend!r}, expected 'csv' or 'sqlite'")
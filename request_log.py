@@ -0,0 +1,165 @@
+"""
+Non-blocking request log.
+
+Request threads only put a LogRecord on a bounded queue (QueueHandler); a single
+QueueListener thread formats each record as one compact JSON line and writes it to
+server.log through a rotating file handler. High-volume routes can be sampled, and
+a full queue drops records (counted in `dropped`) instead of blocking the request.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+REQUEST_LOGGER = "elec.request"
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg and the record's `fields` dict."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: when the queue is full the record is dropped."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the request records of some paths, e.g. {"/meterreading": 0.1}.
+    Error responses (status >= 400) are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def keep(self, path, status):
+        rate = self.rates.get(path)
+        if rate is None or status >= 400:
+            return True
+        return random.random() < rate
+
+    def filter(self, record):
+        fields = getattr(record, "fields", None) or {}
+        return self.keep(fields.get("path"), fields.get("status", 0))
+
+
+def parse_sample_rates(spec):
+    """'/meterreading=0.1,/meterreading/batch=0.5' -> {'/meterreading': 0.1, ...}"""
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        path, rate = item.split("=", 1)
+        rates[path.strip()] = float(rate)
+    return rates
+
+
+def make_file_handler(path, rotate="size", max_bytes=10 * 1024 * 1024, backup_count=5, when="midnight"):
+    if rotate == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count,
+                                                            encoding="utf-8", delay=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding="utf-8", delay=True)
+    handler.setFormatter(JsonLineFormatter())
+    return handler
+
+
+class RequestLogger:
+    """
+    Owns the log queue and its listener thread. `setup()` routes the root logger and
+    the request logger through the queue; `log_request()` is called once per request.
+    """
+
+    def __init__(self, path, rotate="size", max_bytes=10 * 1024 * 1024, backup_count=5, when="midnight",
+                 queue_size=10000, sample_rates=None, body_fields=()):
+        self.path = path
+        self.body_fields = tuple(body_fields)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.file_handler = make_file_handler(path, rotate, max_bytes, backup_count, when)
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler, respect_handler_level=True)
+        self.logger = logging.getLogger(REQUEST_LOGGER)
+        self.sampler = SamplingFilter(sample_rates or {})
+        self._started = False
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def setup(self, level=logging.INFO):
+        """Install the queue handler (root logger + request logger) and start the writer thread."""
+        if self._started:
+            return
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(self.handler)
+        # 请求日志直接进队列，不再传给 root，避免重复
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        self._started = True
+
+    def stop(self):
+        """Write out the records still in the queue and close the file."""
+        if not self._started:
+            return
+        self._started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
+
+    def body_summary(self, body):
+        """Only the configured fields of a parsed body (a list body is logged as its length)."""
+        if isinstance(body, list):
+            return {"items": len(body)}
+        if not hasattr(body, "keys"):   # dict 或 request.form (MultiDict)
+            return None
+        if "readings" in body and isinstance(body["readings"], list):
+            return {"items": len(body["readings"])}
+        return {k: body[k] for k in self.body_fields if k in body}
+
+    def log_request(self, remote_addr, method, path, status, seconds, args=None, body=None):
+        # 先采样再组装记录，被丢弃的请求几乎没有开销
+        if not self.logger.isEnabledFor(logging.INFO) or not self.sampler.keep(path, status):
+            return
+        fields = {
+            "ip": remote_addr,
+            "method": method,
+            "path": path,
+            "status": status,
+            "ms": round(seconds * 1000, 2),
+        }
+        if args:
+            fields["args"] = args
+        summary = self.body_summary(body)
+        if summary:
+            fields["body"] = summary
+        self.logger.info("request", extra={"fields": fields})
@@ -0,0 +1,161 @@
+"""
+Deadline-based daily job scheduler.
+
+Instead of polling the clock, the scheduler thread computes the next run time
+and sleeps until then (or until `trigger()` wakes it up). The day of the last
+run is persisted in a small JSON marker, so the job runs exactly once per day
+even across restarts, and a run missed while the server was down is caught up
+at startup. A lock file keeps several processes from running the job at once.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+
+class DailyScheduler:
+    def __init__(self, job, state_file, run_at="00:05", name="maintenance"):
+        self.job = job
+        self.state_file = state_file
+        self.run_at = datetime.strptime(run_at, "%H:%M").time()
+        self.name = name
+        self.last_duration = None   # 上一次运行耗时（秒）
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._manual = False
+        self._stop = False
+        self._thread = None
+
+    # ---------- persisted marker ----------
+    def last_run_day(self):
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                return datetime.strptime(json.load(f)["last_run_day"], "%Y-%m-%d").date()
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _mark(self, day):
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_run_day": day.isoformat(),
+                       "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                       "duration": self.last_duration}, f)
+        os.replace(tmp_path, self.state_file)
+
+    # ---------- deadlines ----------
+    def due_day(self, now=None):
+        """The most recent day whose scheduled run time has passed."""
+        now = now or datetime.now()
+        today_run = datetime.combine(now.date(), self.run_at)
+        return now.date() if now >= today_run else now.date() - timedelta(days=1)
+
+    def next_deadline(self, now=None):
+        now = now or datetime.now()
+        deadline = datetime.combine(now.date(), self.run_at)
+        if deadline <= now:
+            deadline += timedelta(days=1)
+        return deadline
+
+    # ---------- running ----------
+    def _run_job(self):
+        started = time.monotonic()
+        try:
+            self.job()
+        finally:
+            self.last_duration = time.monotonic() - started
+
+    def run_if_due(self, now=None):
+        """Run the job if today's (or a missed) run has not happened yet. Returns True if it ran."""
+        due = self.due_day(now)
+        with self._lock, _FileLock(self.state_file + ".lock") as acquired:
+            if not acquired:
+                return False   # 另一个进程正在运行
+            last = self.last_run_day()
+            if last is not None and last >= due:
+                return False
+            print(f" {self.name}: running job for {due}")
+            self._run_job()
+            self._mark(due)
+            return True
+
+    def run_now(self):
+        """Run the job immediately (manual trigger); does not move the daily marker."""
+        with self._lock, _FileLock(self.state_file + ".lock") as acquired:
+            if not acquired:
+                return False
+            print(f" {self.name}: manual run")
+            self._run_job()
+            return True
+
+    def trigger(self):
+        """Ask the scheduler thread to run the job now."""
+        self._manual = True
+        self._wake.set()
+
+    # ---------- thread ----------
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-scheduler", daemon=True)
+            self._thread.start()
+            print(f" {self.name} scheduler started, daily run at {self.run_at:%H:%M}.")
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        # 启动时补跑错过的任务
+        self._safe(self.run_if_due)
+        while not self._stop:
+            timeout = (self.next_deadline() - datetime.now()).total_seconds()
+            self._wake.wait(max(timeout, 0))
+            self._wake.clear()
+            if self._stop:
+                return
+            if self._manual:
+                self._manual = False
+                self._safe(self.run_now)
+            else:
+                self._safe(self.run_if_due)
+
+    def _safe(self, func):
+        try:
+            func()
+        except Exception as e:
+            print(f" {self.name}: job failed: {e}")
+
+
+class _FileLock:
+    """Non-blocking inter-process lock; yields False if another process holds it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
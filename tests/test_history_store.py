@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+from history_store import DailyHistory
+from reading_store import to_epoch
+
+
+def epochs(*values):
+    return np.array([to_epoch(v) for v in values], dtype=np.int64)
+
+
+def test_merge_keeps_latest_row_per_meter_and_day(tmp_path):
+    history = DailyHistory(str(tmp_path / "daily"))
+    history.merge(["a", "a", "b"], epochs("2025-03-01 23:50:00", "2025-03-02 23:55:00", "2025-03-01 23:59:00"),
+                  [10.0, 20.0, 5.0])
+    first_dir = history.partitions()["2025-03"]["path"]
+
+    # 第二次合并：a 在 3/1 有更晚的读数（替换），b 在 3/1 的读数更早（保留原来的）
+    history.merge(["a", "b", "c"], epochs("2025-03-01 23:58:00", "2025-03-01 08:00:00", "2025-03-03 23:00:00"),
+                  [11.0, 1.0, 7.0])
+    meta = history.partitions()["2025-03"]
+    assert meta["version"] == 2 and meta["rows"] == 4
+    assert not os.path.exists(os.path.join(history.root, first_dir))   # 旧版本目录已删除
+
+    meter_ids, times, readings = history.read_partition("2025-03")
+    assert meter_ids.tolist() == ["a", "a", "b", "c"]
+    assert times.tolist() == epochs("2025-03-01 23:58:00", "2025-03-02 23:55:00",
+                                    "2025-03-01 23:59:00", "2025-03-03 23:00:00").tolist()
+    assert readings.tolist() == [11.0, 20.0, 5.0, 7.0]
+
+
+def test_merge_rewrites_only_touched_months(tmp_path):
+    history = DailyHistory(str(tmp_path / "daily"))
+    history.merge(["a", "a"], epochs("2025-02-28 23:00:00", "2025-03-01 23:00:00"), [1.0, 2.0])
+    history.merge(["a"], epochs("2025-03-01 23:30:00"), [3.0])
+    partitions = history.partitions()
+    assert partitions["2025-02"]["version"] == 1
+    assert partitions["2025-03"]["version"] == 2
+
+    frame = history.load_range("a", to_epoch("2025-02-01 00:00:00"), to_epoch("2025-03-31 23:59:59"))
+    assert frame["reading"].tolist() == [1.0, 3.0]
+    assert frame["time"].astype("datetime64[s]").astype(np.int64).tolist() == \
+        epochs("2025-02-28 23:00:00", "2025-03-01 23:30:00").tolist()
+
+
+def test_reader_sees_partition_rewritten_by_another_instance(tmp_path):
+    root = str(tmp_path / "daily")
+    reader = DailyHistory(root)
+    writer = DailyHistory(root)
+    writer.merge(["a"], epochs("2025-03-01 23:00:00"), [1.0])
+    start, end = to_epoch("2025-03-01 00:00:00"), to_epoch("2025-03-31 23:59:59")
+    assert reader.load_range("a", start, end)["reading"].tolist() == [1.0]
+
+    # 另一个进程（维护任务）改写了分区：读取方按新 manifest 打开新版本目录
+    writer.merge(["a", "b"], epochs("2025-03-01 23:59:00", "2025-03-02 23:00:00"), [2.0, 4.0])
+    assert reader.load_range("a", start, end)["reading"].tolist() == [2.0]
+    meter_ids, _, readings = reader.load_days(start, end)
+    assert meter_ids.tolist() == ["a", "b"] and readings.tolist() == [2.0, 4.0]
+
+
+def test_replace_drops_old_partitions(tmp_path):
+    history = DailyHistory(str(tmp_path / "daily"))
+    history.merge(["a", "a"], epochs("2025-02-10 23:00:00", "2025-03-10 23:00:00"), [1.0, 2.0])
+    history.merge(["b"], epochs("2025-03-11 23:00:00"), [9.0], replace=True)
+    assert list(history.partitions()) == ["2025-03"]
+    assert history.read_partition("2025-03")[0].tolist() == ["b"]
@@ -0,0 +1,99 @@
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from reading_dedup import CONFLICT, DUPLICATE, MERGE_MIN, NEW, IdempotencyCache, ReadingDedup, _DaySet
+from reading_store import SECONDS_PER_DAY, to_epoch
+from repository import SqliteRepository
+
+
+def now_epoch():
+    return to_epoch(datetime.now().replace(microsecond=0))
+
+
+def test_dayset_merge_keeps_last_value():
+    day = _DaySet()
+    for key in range(MERGE_MIN + 1):   # 超过 MERGE_MIN 时合并到有序数组
+        day.put(key, float(key))
+    assert day.recent == {} and len(day.keys) == MERGE_MIN + 1
+    assert np.all(np.diff(day.keys) > 0)
+    day.extend([5, 5, 10**9], [50.0, 51.0, 1.0])
+    assert day.get(5) == 51.0
+    assert day.get(10**9) == 1.0
+    assert day.get(-1) is None
+
+
+def test_dayset_tombstone_is_dropped_on_merge():
+    day = _DaySet()
+    day.extend([1, 2, 3], [1.0, 2.0, 3.0])
+    day.discard(2)
+    assert day.get(2) is None
+    day.put(7, 7.0)
+    day.discard(7)   # 只在 recent 里的 key 直接删除
+    assert day.get(7) is None
+    day.extend([], [])
+    assert day.keys.tolist() == [1, 3]
+    day.put(2, 20.0)
+    assert day.get(2) == 20.0
+
+
+def test_check_and_add_and_rollback():
+    dedup = ReadingDedup(days=2)
+    t = now_epoch()
+    statuses, _ = dedup.check_and_add(["a", "a", "b"], [t, t, t], [1.0, 1.0, 2.0])
+    assert statuses.tolist() == [NEW, DUPLICATE, NEW]
+    statuses, previous = dedup.check_and_add(["b"], [t], [3.0])
+    assert statuses.tolist() == [CONFLICT] and previous[0] == 2.0
+    # 没有存下来的读数要忘掉，重发时是 NEW
+    dedup.rollback(["a"], [t])
+    statuses, _ = dedup.check_and_add(["a"], [t], [1.0])
+    assert statuses.tolist() == [NEW]
+    assert dedup.duplicates == 1 and dedup.conflicts == 1
+
+
+def test_readings_outside_window_are_not_checked():
+    dedup = ReadingDedup(days=2)
+    old = now_epoch() - 5 * SECONDS_PER_DAY
+    dedup.add(["a"], [old], [1.0])
+    statuses, _ = dedup.check_and_add(["a"], [old], [2.0])
+    assert statuses.tolist() == [NEW]
+
+
+def test_sqlite_skips_reading_stored_by_another_worker(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SqliteRepository(path), SqliteRepository(path)
+    first.open()
+    second.open()
+    t = now_epoch()
+    assert np.isnan(first.append_readings(["m1", "m2"], [t, t], [1.0, 2.0])).all()
+    previous = second.append_readings(["m1", "m2", "m3"], [t, t, t], [1.0, 5.0, 3.0])
+    assert previous[:2].tolist() == [1.0, 2.0] and np.isnan(previous[2])
+    assert second.readings_end() == 3
+
+
+def test_sqlite_old_database_is_made_unique(tmp_path):
+    path = str(tmp_path / "state.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE readings (id INTEGER PRIMARY KEY, meter_id TEXT NOT NULL, time INTEGER NOT NULL, reading REAL NOT NULL);
+        CREATE INDEX readings_meter_time ON readings (meter_id, time);
+        INSERT INTO readings (meter_id, time, reading) VALUES ('m1', 0, 1.0), ('m1', 0, 2.0), ('m2', 0, 3.0);
+    """)
+    conn.close()
+    repository = SqliteRepository(path)
+    repository.open()
+    rows = repository.connect().execute("SELECT meter_id, reading FROM readings ORDER BY id").fetchall()
+    assert rows == [("m1", 1.0), ("m2", 3.0)]
+
+
+def test_idempotency_cache_is_bounded_by_bytes():
+    cache = IdempotencyCache(max_entries=100, max_bytes=10_000)
+    for i in range(20):
+        cache.put(("/b", str(i)), "f", 200, b"x" * 1000)
+    assert cache.nbytes <= 10_000 and len(cache) < 20
+    assert cache.lookup(("/b", "0"), "f") is None          # 最早的被淘汰
+    assert cache.lookup(("/b", "19"), "f") == (200, b"x" * 1000)
+    assert cache.lookup(("/b", "19"), "other") is False
+    cache.put(("/b", "big"), "f", 200, b"x" * 20_000)      # 超过上限的不缓存
+    assert cache.lookup(("/b", "big"), "f") is None
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from reading_log import ReadingLog, count_rows, iter_log
+from reading_store import ReadingStore, to_epoch
+
+
+def open_log(path):
+    return ReadingLog(str(path), fsync="none")
+
+
+def test_torn_tail_is_dropped_on_open(tmp_path):
+    path = tmp_path / "local_db.csv"
+    log = open_log(path)
+    log.append_batch(["a", "b"], [to_epoch("2025-03-01 00:00:00"), to_epoch("2025-03-01 00:30:00")], [1.0, 2.5])
+    log.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("c,2025-03-01 01:00")   # 崩溃时写了一半的行
+
+    log = open_log(path)
+    assert path.read_text(encoding="utf-8").endswith("b,2025-03-01 00:30:00,2.5\n")
+    log.append_batch(["c"], [to_epoch("2025-03-01 01:00:00")], [3.0])
+    store = ReadingStore()
+    assert log.replay(store) == 3
+    meter_ids, _, readings = store.since(0)
+    assert meter_ids.tolist() == ["a", "b", "c"]
+    assert readings.tolist() == [1.0, 2.5, 3.0]
+    log.close()
+
+
+def test_replay_id_counts_malformed_rows(tmp_path):
+    path = tmp_path / "local_db.csv"
+    log = open_log(path)
+    log.append_batch(["a"], [to_epoch("2025-03-01 00:00:00")], [1.0])
+    log.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("x,bad,1\n1,2,3,4\nc,2025-03-01 00:02:00,nan\n")
+
+    log = open_log(path)
+    log.append_batch(["b"], [to_epoch("2025-03-01 00:03:00")], [2.0])
+    store = ReadingStore()
+    # 坏行被跳过（打印警告）但仍占一个 id：最后一条读数的 id 就是它的行号，重启前后一致
+    with pytest.warns(pd.errors.ParserWarning):
+        assert log.replay(store) == 5 == count_rows(str(path))
+    assert store.since(0)[0].tolist() == ["a", "b"]
+    log.close()
+
+
+def test_replay_since_keeps_recent_rows(tmp_path):
+    log = open_log(tmp_path / "local_db.csv")
+    times = [to_epoch("2025-02-28 23:59:59"), to_epoch("2025-03-01 00:00:00"), to_epoch("2025-03-02 12:00:00")]
+    log.append_batch(["a", "b", "c"], times, [1.0, 2.0, 3.0])
+    store = ReadingStore()
+    assert log.replay(store, since=to_epoch("2025-03-01 00:00:00")) == 3
+    meter_ids, replayed, _ = store.since(0)
+    assert meter_ids.tolist() == ["b", "c"]
+    assert replayed.tolist() == times[1:]
+    log.close()
+
+
+def test_meter_id_with_comma_round_trips(tmp_path):
+    path = tmp_path / "local_db.csv"
+    log = open_log(path)
+    log.append_batch(['a,1', 'b"2'], [to_epoch("2025-03-01 00:00:00")] * 2, [1.0, 2.0])
+    store = ReadingStore()
+    assert log.replay(store) == 2
+    assert store.since(0)[0].tolist() == ['a,1', 'b"2']
+    log.close()
+    exported = [m for chunk in iter_log(str(path)) for m in chunk[0]]
+    assert exported == ['a,1', 'b"2']
@@ -0,0 +1,78 @@
+import json
+from datetime import date, datetime
+
+import pytest
+
+from scheduler import DailyScheduler
+
+
+class CountingJob:
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("job failed")
+
+
+def make_scheduler(tmp_path, job):
+    return DailyScheduler(job, str(tmp_path / "maintenance.json"), run_at="00:05")
+
+
+def test_runs_once_per_day_across_restarts(tmp_path):
+    job = CountingJob()
+    scheduler = make_scheduler(tmp_path, job)
+    assert scheduler.run_if_due(datetime(2025, 3, 1, 0, 10))
+    assert not scheduler.run_if_due(datetime(2025, 3, 1, 23, 0))
+    # 重启：新实例读取持久化的标记，不会再跑一次
+    restarted = make_scheduler(tmp_path, job)
+    assert restarted.last_run_day() == date(2025, 3, 1)
+    assert not restarted.run_if_due(datetime(2025, 3, 1, 12, 0))
+    # 第二天 00:05 之前还不到时间
+    assert not restarted.run_if_due(datetime(2025, 3, 2, 0, 4))
+    assert restarted.run_if_due(datetime(2025, 3, 2, 0, 5))
+    assert job.calls == 2
+
+
+def test_missed_days_are_caught_up_with_one_run(tmp_path):
+    job = CountingJob()
+    scheduler = make_scheduler(tmp_path, job)
+    assert scheduler.run_if_due(datetime(2025, 3, 1, 1, 0))
+    # 服务器停了几天：启动时只补跑一次，标记记为最近到期的那一天
+    restarted = make_scheduler(tmp_path, job)
+    assert restarted.run_if_due(datetime(2025, 3, 5, 0, 1))
+    assert restarted.last_run_day() == date(2025, 3, 4)
+    assert not restarted.run_if_due(datetime(2025, 3, 5, 0, 2))
+    assert restarted.run_if_due(datetime(2025, 3, 5, 0, 6))
+    assert job.calls == 3
+
+
+def test_failed_job_does_not_move_the_marker(tmp_path):
+    job = CountingJob(fail=True)
+    scheduler = make_scheduler(tmp_path, job)
+    with pytest.raises(RuntimeError):
+        scheduler.run_if_due(datetime(2025, 3, 1, 1, 0))
+    assert scheduler.last_run_day() is None
+    job.fail = False
+    assert scheduler.run_if_due(datetime(2025, 3, 1, 1, 1))
+    assert job.calls == 2
+
+
+def test_run_now_does_not_move_the_marker(tmp_path):
+    job = CountingJob()
+    scheduler = make_scheduler(tmp_path, job)
+    assert scheduler.run_now()
+    assert scheduler.last_run_day() is None
+    assert scheduler.run_if_due(datetime(2025, 3, 1, 1, 0))
+    assert job.calls == 2
+
+
+def test_unreadable_marker_counts_as_never_run(tmp_path):
+    state_file = tmp_path / "maintenance.json"
+    state_file.write_text("{", encoding="utf-8")
+    job = CountingJob()
+    scheduler = DailyScheduler(job, str(state_file), run_at="00:05")
+    assert scheduler.run_if_due(datetime(2025, 3, 1, 1, 0))
+    assert json.loads(state_file.read_text(encoding="utf-8"))["last_run_day"] == "2025-03-01"
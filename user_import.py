@@ -0,0 +1,202 @@
+"""
+Bulk registration of households from a CSV or JSON file.
+
+    python user_import.py new_estate.csv                 # straight into the storage
+    python user_import.py new_estate.csv --dry-run       # only validate
+    python user_import.py new_estate.json --url http://localhost:5000
+
+All rows are validated in one vectorized pass (required fields, dwelling type and
+region, email / tel format, meter_ids repeated in the file or already registered),
+the accepted rows are added in one write and every rejected row is reported with
+its reason. The same code serves POST /register/bulk.
+
+Without --url the file is written straight into the storage of ELEC_STATE_BACKEND;
+with the csv backend only do that while the server is stopped (the server keeps
+users.csv in memory and would overwrite it). With --url the file is posted to a
+running server instead.
+"""
+import argparse
+import io
+import json
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from reading_store import to_epoch
+
+DWELLING_TYPES = [
+    "1-room / 2-room",
+    "3-room",
+    "4-room",
+    "5-room and Executive",
+    "Landed Properties",
+    "Private Apartments and Condominiums"
+]
+REGIONS = ["Central", "East", "West", "North", "South"]
+
+USER_FIELDS = ["username", "meter_id", "dwelling_type", "region", "area", "community",
+               "unit", "floor", "email", "tel"]
+# meter_id 会写进 local_db.csv 等文件：只允许字母、数字和 -
+METER_ID_PATTERN = r"[A-Za-z0-9\-]{1,32}"
+METER_ID_MESSAGE = "Invalid Meter ID: use only letters, digits and '-' (at most 32 characters)."
+EMAIL_PATTERN = r"[^@\s]+@[^@\s]+\.[^@\s]+"
+TEL_PATTERN = r"\+?\d[\d\- ]{5,18}\d"
+
+
+def read_users(data, fmt=None):
+    """
+    Parse an uploaded file (bytes or str) into a DataFrame of strings with USER_FIELDS.
+    `fmt` is "csv" or "json"; without it JSON is assumed when the data starts with [ or {.
+    A JSON file is an array of objects, or {"users": [...]}.
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    if fmt is None:
+        fmt = "json" if data.lstrip()[:1] in ("[", "{") else "csv"
+    if fmt == "json":
+        records = json.loads(data)
+        if isinstance(records, dict):
+            records = records.get("users")
+        if not isinstance(records, list):
+            raise ValueError("JSON body must be an array of users.")
+        frame = pd.DataFrame([r if isinstance(r, dict) else {} for r in records])
+    else:
+        frame = pd.read_csv(io.StringIO(data), dtype=str, keep_default_na=False)
+    frame = frame.reindex(columns=USER_FIELDS)
+    return frame.apply(lambda column: column.fillna("").astype(str).str.strip())
+
+
+def validate_users(frame, is_registered):
+    """
+    Validate every row at once. `is_registered(meter_ids)` returns a boolean array.
+    Returns (accepted rows with USER_FIELDS, keeping their row index in `frame`,
+    messages) where messages[i] is the reason row i was rejected, or None.
+    """
+    missing = (frame[USER_FIELDS] == "").any(axis=1)
+    meter_ids = frame["meter_id"]
+    duplicate = meter_ids.duplicated(keep="first") & (meter_ids != "")
+    registered = pd.Series(is_registered(meter_ids.tolist()), index=frame.index, dtype=bool)
+
+    # 按优先级给出每行的错误信息，None 表示通过
+    checks = [
+        (missing, "Please fill out all fields."),
+        (~meter_ids.str.fullmatch(METER_ID_PATTERN), METER_ID_MESSAGE),
+        (~frame["dwelling_type"].isin(DWELLING_TYPES), "Unknown dwelling type."),
+        (~frame["region"].isin(REGIONS), "Unknown region."),
+        (~frame["email"].str.fullmatch(EMAIL_PATTERN), "Invalid email address."),
+        (~frame["tel"].str.fullmatch(TEL_PATTERN), "Invalid telephone number."),
+        (duplicate, "Duplicate meter_id in this file."),
+        (registered, "The Meter ID has been registered."),
+    ]
+    messages = np.full(len(frame), None, dtype=object)
+    for failed, message in reversed(checks):
+        messages[failed.to_numpy(dtype=bool)] = message
+
+    accepted = frame[pd.isna(messages)]
+    return accepted, messages.tolist()
+
+
+def new_user_records(accepted, now=None):
+    """Accepted rows as full user records: initial reading 0 at today 00:00, like register()."""
+    now = now or datetime.now()
+    records = accepted[USER_FIELDS].copy()
+    records["reading"] = 0.0
+    records["time"] = now.replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
+    return records
+
+
+def results(messages, meter_ids):
+    """Per-row results in the format of /meterreading/batch."""
+    return [
+        {"index": i, "meter_id": m, "status": "error", "message": msg} if msg else
+        {"index": i, "meter_id": m, "status": "success"}
+        for i, (msg, m) in enumerate(zip(messages, meter_ids))
+    ]
+
+
+def import_users(repository, frame, dry_run=False, submit_readings=None):
+    """
+    Validate `frame` and add the accepted users through `repository` in one write.
+    Every new meter gets an initial reading 0 at today 00:00, like register(): passed
+    to `submit_readings(DataFrame meter_id/time/reading)` (the server's ingest queue),
+    or appended to the repository directly. Returns (added meter_ids, messages).
+    """
+    accepted, messages = validate_users(frame, repository.has_users)
+    if dry_run or accepted.empty:
+        return [], messages
+
+    records = new_user_records(accepted)
+    added = repository.add_users(records)
+    # 校验之后、写入之前被别人注册的电表
+    for position in records.index[~added]:
+        messages[position] = "The Meter ID has been registered."
+
+    new_ids = records["meter_id"].to_numpy()[added]
+    if len(new_ids):
+        readings = pd.DataFrame({"meter_id": new_ids,
+                                 "time": np.full(len(new_ids), to_epoch(records["time"].iloc[0]), dtype=np.int64),
+                                 "reading": np.zeros(len(new_ids))})
+        if submit_readings is not None:
+            submit_readings(readings)
+        else:
+            repository.append_readings(readings["meter_id"].to_numpy(), readings["time"].to_numpy(),
+                                       readings["reading"].to_numpy())
+    return new_ids.tolist(), messages
+
+
+def post_file(url, data, fmt, dry_run=False):
+    """Send the file to POST {url}/register/bulk of a running server and return its JSON answer."""
+    import urllib.error
+    import urllib.request
+    content_type = "application/json" if fmt == "json" else "text/csv"
+    endpoint = url.rstrip("/") + "/register/bulk" + ("?dry_run=1" if dry_run else "")
+    request = urllib.request.Request(endpoint, data=data,
+                                     headers={"Content-Type": content_type}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk registration of households from a CSV or JSON file.")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=("csv", "json"), help="default: from the file extension")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, add nothing")
+    parser.add_argument("--url", help="post the file to a running server instead (e.g. http://localhost:5000)")
+    args = parser.parse_args(argv)
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    fmt = args.format or ("json" if args.file.lower().endswith(".json") else "csv")
+
+    if args.url:
+        answer = post_file(args.url, data, fmt, dry_run=args.dry_run)
+        for row in answer.get("results", []):
+            if row["status"] == "error":
+                print(f"row {row['index'] + 1}: {row.get('meter_id', '')}: {row['message']}")
+        print(f"Accepted {answer.get('accepted', 0)}, rejected {answer.get('rejected', 0)}"
+              + (f" ({answer['message']})" if "message" in answer else ""))
+        return 0 if answer.get("status") in ("success", "partial") else 1
+
+    from repository import open_repository
+    repository = open_repository()
+    repository.open()
+    try:
+        frame = read_users(data, fmt)
+        added, messages = import_users(repository, frame, dry_run=args.dry_run)
+    finally:
+        repository.close()
+    for i, message in enumerate(messages):
+        if message:
+            print(f"row {i + 1}: {frame['meter_id'].iloc[i]}: {message}")
+    accepted = sum(m is None for m in messages)
+    print(f"{'Would add' if args.dry_run else 'Added'} {accepted} users, rejected {len(messages) - accepted}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
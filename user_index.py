@@ -0,0 +1,44 @@
+"""
+Hash index on the users table: meter_id -> row position.
+
+The users DataFrame is only ever appended to (pd.concat with ignore_index), so a
+row's position never changes and the index only needs `add()` on register.
+"""
+import numpy as np
+
+
+class UserIndex:
+    def __init__(self, users=None):
+        self._positions = {}
+        if users is not None:
+            self.rebuild(users)
+
+    def rebuild(self, users):
+        self._positions = {str(m): i for i, m in enumerate(users["meter_id"])}
+
+    def __contains__(self, meter_id):
+        return str(meter_id) in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def get(self, meter_id):
+        """Row position of a meter_id, or None if it is not registered."""
+        return self._positions.get(str(meter_id))
+
+    def add(self, meter_id, position):
+        self._positions[str(meter_id)] = position
+
+    def add_many(self, meter_ids, start):
+        """Index rows appended together: meter_ids[i] is at position start + i."""
+        self._positions.update((str(m), start + i) for i, m in enumerate(meter_ids))
+
+    def contains_many(self, meter_ids):
+        """Boolean array: which of `meter_ids` are registered."""
+        positions = self._positions
+        return np.fromiter((str(m) in positions for m in meter_ids), dtype=bool, count=len(meter_ids))
+
+    def positions(self, meter_ids):
+        """Row positions of `meter_ids` (-1 for unregistered ones)."""
+        positions = self._positions
+        return np.fromiter((positions.get(str(m), -1) for m in meter_ids), dtype=np.int64, count=len(meter_ids))
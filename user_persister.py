@@ -0,0 +1,108 @@
+"""
+Debounced, atomic persistence of the users table to users.csv.
+
+Callers mark the rows they changed; the file is rewritten only once the number
+of dirty rows reaches `max_dirty` or `interval` seconds have passed since the
+first unsaved change. Each write goes to a temporary file that is fsync'ed and
+then moved over users.csv with os.replace, so a crash never leaves a
+truncated file behind. Flushes are serialized and every one uses its own
+temporary file (request threads and the background thread may flush at once).
+"""
+import os
+import tempfile
+import threading
+import time
+
+from reading_store import TIME_FORMAT
+
+
+class UserPersister:
+    def __init__(self, path, get_users, lock, interval=5.0, max_dirty=10000):
+        self.path = path
+        self.get_users = get_users   # 返回当前 users DataFrame（全局变量会被重新赋值）
+        self.lock = lock             # 与修改 users 的代码共用的锁
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._dirty = set()
+        self._dirty_since = None
+        self._dirty_lock = threading.Lock()
+        self._flush_lock = threading.Lock()   # 同一时间只有一个线程写 users.csv
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def dirty_count(self):
+        return len(self._dirty)
+
+    def mark_dirty(self, positions):
+        """Record changed row positions; flushes right away once `max_dirty` is reached."""
+        with self._dirty_lock:
+            self._dirty.update(int(p) for p in positions)
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            due = len(self._dirty) >= self.max_dirty
+        if due:
+            try:
+                self.flush()
+            except Exception as e:   # 改动的行仍是 dirty，后台线程会重试；不影响调用方
+                print(f"Error saving users.csv: {e}")
+
+    def flush(self):
+        """Write users.csv now if anything changed."""
+        with self._flush_lock:
+            with self._dirty_lock:
+                if not self._dirty:
+                    return
+                dirty = self._dirty
+                self._dirty = set()
+                self._dirty_since = None
+
+            try:
+                with self.lock:
+                    snapshot = self.get_users().copy()
+                self._write(snapshot)
+            except Exception:
+                # 写入失败：把这些行放回 dirty，下次再写
+                with self._dirty_lock:
+                    self._dirty |= dirty
+                    if self._dirty_since is None:
+                        self._dirty_since = time.monotonic()
+                raise
+        print(f"Saved users.csv ({len(dirty)} changed rows)")
+
+    def _write(self, snapshot):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=directory)
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as f:
+                snapshot.to_csv(f, index=False, date_format=TIME_FORMAT)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="users-persister", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and write any pending changes."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        tick = min(self.interval, 1.0)
+        while not self._stop.wait(tick):
+            since = self._dirty_since
+            if since is not None and time.monotonic() - since >= self.interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error saving users.csv: {e}")
@@ -0,0 +1,126 @@
+"""
+Compact in-memory layout of the users table.
+
+Every worker keeps the whole table resident, so its columns use the smallest
+dtype that still round-trips through users.csv:
+
+    dwelling_type, region, area, community, floor   category (small int codes + one copy of each value)
+    reading                                         float64
+    time                                            datetime64[s]
+    username, meter_id, unit, email, tel            str (free-form, kept as text)
+
+New rows go through append_users(), which extends the categories so the
+columns never fall back to object. UserRecord is a __slots__ record for
+reading a single user (view_user) without building a Series.
+
+    python user_table.py [users.csv]    # memory per column, before and after
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from reading_store import TIME_FORMAT
+
+USER_COLUMNS = ["username", "meter_id", "dwelling_type", "region", "area", "community",
+                "unit", "floor", "email", "tel", "reading", "time"]
+CATEGORY_COLUMNS = ["dwelling_type", "region", "area", "community", "floor"]
+
+
+def read_users_csv(path):
+    """users.csv as the plain (all-text) frame, before compact()."""
+    return pd.read_csv(path, dtype=str, keep_default_na=False).reindex(columns=USER_COLUMNS)
+
+
+def compact(frame, like=None):
+    """
+    Convert a users frame (any dtypes, e.g. strings from a form or a file) to the
+    compact layout. With `like` (the resident table) the categorical columns get the
+    union of both sets of categories, so the two frames can be concatenated.
+    """
+    frame = frame.reindex(columns=USER_COLUMNS)
+    columns = {}
+    for column in USER_COLUMNS:
+        values = frame[column]
+        if column == "reading":
+            columns[column] = pd.to_numeric(values, errors="coerce").astype(np.float64)
+        elif column == "time":
+            columns[column] = pd.to_datetime(values, format=TIME_FORMAT, errors="coerce").astype("datetime64[s]")
+        else:
+            text = values.astype(str).where(values.notna(), "")
+            if column in CATEGORY_COLUMNS:
+                categories = pd.Index(text.unique())
+                if like is not None:
+                    categories = like[column].cat.categories.union(categories, sort=False)
+                text = pd.Categorical(text, categories=categories)
+            columns[column] = text
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def append_users(users, rows):
+    """users + rows (both compact or not) as one compact frame with a fresh RangeIndex."""
+    rows = compact(rows, like=users)
+    if users.empty:
+        return rows.reset_index(drop=True)
+    users = users.copy()
+    for column in CATEGORY_COLUMNS:
+        users[column] = users[column].cat.set_categories(rows[column].cat.categories)
+    return pd.concat([users, rows], ignore_index=True)
+
+
+def memory_bytes(frame):
+    """Bytes held by every column (deep: counts the Python strings too)."""
+    return frame.memory_usage(index=False, deep=True)
+
+
+def memory_report(before, after):
+    """One line per column plus the total: size of `before` and `after`."""
+    old, new = memory_bytes(before), memory_bytes(after)
+    lines = [f"{'column':15} {'dtype':>15} {'before':>12} {'after':>12}"]
+    for column in after.columns:
+        lines.append(f"{column:15} {str(after[column].dtype):>15} {old.get(column, 0):>12,} {new[column]:>12,}")
+    lines.append(f"{'total':15} {'':>15} {old.sum():>12,} {new.sum():>12,}")
+    return "\n".join(lines)
+
+
+class UserRecord:
+    """One user, read straight from the compact columns."""
+
+    __slots__ = tuple(USER_COLUMNS)
+
+    def __init__(self, **values):
+        for column in USER_COLUMNS:
+            setattr(self, column, values.get(column))
+
+    @classmethod
+    def from_frame(cls, frame, position):
+        record = cls.__new__(cls)
+        for column in USER_COLUMNS:
+            value = frame[column].iat[position]
+            if column == "time":
+                value = value.strftime(TIME_FORMAT) if not pd.isna(value) else None
+            elif column == "reading":
+                value = float(value)
+            setattr(record, column, value)
+        return record
+
+    def to_dict(self):
+        return {column: getattr(self, column) for column in USER_COLUMNS}
+
+    def __repr__(self):
+        return f"UserRecord(meter_id={self.meter_id!r}, username={self.username!r})"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    import config
+    path = argv[0] if argv else config.USERS_CSV_FILE
+    before = pd.read_csv(path, dtype={"meter_id": str, "reading": float})   # 原来的读法
+    after = compact(read_users_csv(path))
+    print(f"{path}: {len(after)} users")
+    print(memory_report(before, after))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
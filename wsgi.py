@@ -0,0 +1,17 @@
+"""
+WSGI entry point for production (no debugger, no auto-reloader).
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py starts several worker processes and switches them to the shared
+SQLite state (ELEC_STATE_BACKEND=sqlite), so every worker sees the same users and
+readings. `python wsgi.py` serves a single process with werkzeug's threaded server.
+"""
+import app4
+
+app = app4.create_app()
+
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    app4.start_background()
+    run_simple("0.0.0.0", 5000, app, threaded=True, use_reloader=False, use_debugger=False)